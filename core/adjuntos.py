@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+import pdfplumber
+from pdfminer.pdfpage import PDFPage
+from pdfplumber.page import Page
+from docx import Document
+from PIL import Image
+
+from core.contexto import estimar_tokens
+
+
+# ==========================================
+# LÍMITES DE EXTRACCIÓN
+# ==========================================
+# El texto de un adjunto termina dentro del prompt: no tiene sentido leer
+# (ni tener en memoria) más de lo que cabe. Un manual de 500 páginas se lee
+# hasta llenar el presupuesto y el resto ni se abre.
+
+MAX_TOKENS_ADJUNTO = int(os.getenv("ADJUNTO_MAX_TOKENS", "4000"))
+MAX_FILAS_EXCEL = int(os.getenv("ADJUNTO_MAX_FILAS", "20"))
+
+# Copia a disco en bloques de 1 MB
+TAMANO_BLOQUE = 1024 * 1024
+
+
+# ==========================================
+# ADJUNTO EN ARCHIVO TEMPORAL
+# ==========================================
+# La subida se vuelca a disco por bloques: ni el proceso principal ni el
+# worker que extrae el texto tienen el archivo completo en memoria (al
+# worker solo viaja la ruta).
+
+def guardar_en_temporal(origen):
+
+    with tempfile.NamedTemporaryFile(prefix="adjunto_", delete=False) as destino:
+        # delete=False: si la copia falla (subida cortada, disco lleno,
+        # cancelación) el temporal se borra acá, nadie más tiene la ruta
+        try:
+            shutil.copyfileobj(origen, destino, TAMANO_BLOQUE)
+        except BaseException:
+            destino.close()
+            os.unlink(destino.name)
+            raise
+        return destino.name, destino.tell()
+
+
+def borrar_temporal(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+
+# ==========================================
+# PRESUPUESTO DE TEXTO
+# ==========================================
+
+class PresupuestoTexto:
+
+    def __init__(self, max_tokens):
+        self.restante = max_tokens
+        self.partes = []
+        self.recortado = False
+
+    def agregar(self, texto):
+        # False = presupuesto agotado, no seguir leyendo
+        costo = estimar_tokens(texto)
+
+        if costo > self.restante:
+            # Se corta el último fragmento a ~4 caracteres por token
+            if self.restante > 0:
+                self.partes.append(texto[:self.restante * 4])
+            self.restante = 0
+            self.recortado = True
+            return False
+
+        self.partes.append(texto)
+        self.restante -= costo
+        return True
+
+    def texto(self, separador, aviso=None):
+        texto = separador.join(self.partes)
+        if self.recortado and aviso:
+            texto += f"\n\n[{aviso}]"
+        return texto
+
+
+# ==========================================
+# EXTRACTORES LOCALES
+# ==========================================
+# Viven fuera de main.py para poder ejecutarse en un pool de procesos: los
+# workers importan solo este módulo (no cargan el Sheet ni configuran Gemini).
+
+def extraer_de_pdf(ruta):
+
+    presupuesto = PresupuestoTexto(MAX_TOKENS_ADJUNTO)
+    leidas = 0
+
+    with pdfplumber.open(ruta) as pdf:
+
+        # pdf.pages arma un Page por cada página antes de devolver la
+        # primera: se recorre el árbol de páginas de pdfminer de a una, se
+        # extrae, se agrega y se liberan sus objetos
+        for numero, pagina in enumerate(PDFPage.create_pages(pdf.doc), start=1):
+            page = Page(pdf, pagina, page_number=numero)
+            seguir = presupuesto.agregar(page.extract_text() or "")
+            page.close()
+            leidas += 1
+            if not seguir:
+                break
+
+    return presupuesto.texto("\n", f"Documento recortado: se leyeron {leidas} páginas")
+
+def extraer_de_docx(ruta):
+
+    presupuesto = PresupuestoTexto(MAX_TOKENS_ADJUNTO)
+
+    for p in Document(ruta).paragraphs:
+        if not presupuesto.agregar(p.text):
+            break
+
+    return presupuesto.texto("\n", "Documento recortado")
+
+def extraer_de_excel_adjunto(ruta):
+    # nrows: el lector openpyxl de pandas abre el libro en modo read-only
+    # y deja de recorrer la hoja al llegar a las filas pedidas
+    df = pd.read_excel(ruta, nrows=MAX_FILAS_EXCEL)
+    return df.to_markdown(index=False)
+
+def abrir_imagen(ruta):
+    with Image.open(ruta) as imagen:
+        return imagen.convert("RGB")
+
+
+def extractor_para(mimetype):
+
+    if "pdf" in mimetype:
+        return extraer_de_pdf
+    if "word" in mimetype or "officedocument.wordprocessingml" in mimetype:
+        return extraer_de_docx
+    if "excel" in mimetype or "officedocument.spreadsheetml" in mimetype:
+        return extraer_de_excel_adjunto
+
+    return None
@@ -1,9 +1,12 @@
 import pandas as pd
 import re
-import unicodedata
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import KMeans
 
+from core.texto import normalizar_simbolos
+from core.rag import obtener_indice_analisis, obtener_cubos
+from core.cubos import textos_que_contienen
+
 
 # ==========================================
 # 🔥 FUNCIÓN NUEVA (CLAVE)
@@ -20,81 +23,57 @@ def obtener_columna_principal(df):
 # NORMALIZADOR LOCAL
 # ==========================================
 
-def normalizar(texto):
-    if not texto:
-        return ""
-    texto = str(texto).lower()
-    texto = "".join(
-        c for c in unicodedata.normalize('NFD', texto)
-        if unicodedata.category(c) != 'Mn'
-    )
-    return texto
+# Variante que conserva guiones y símbolos (solo minúsculas y sin acentos)
+normalizar = normalizar_simbolos
 
 
 # ==========================================
 # 🔥 DETECCIÓN DE EQUIPO MEJORADA
 # ==========================================
 
-def detectar_equipo_desde_texto(df, texto):
+def detectar_equipo_desde_texto(df, texto, indice=None):
 
-    texto = normalizar(texto)
     texto_limpio = normalizar(texto).strip()
     col_principal = obtener_columna_principal(df)
 
     if col_principal is None or not texto_limpio:
         return None
-    
+
+    # 🔥 Índices precalculados en cada recarga de datos (o al vuelo si el
+    # DataFrame no es el del cache)
+    if indice is None:
+        indice = obtener_indice_analisis(df)
+
+    if not indice:
+        return None
+
+    equipos = df[col_principal]
+
     # ==========================================
     # 🔎 1. BÚSQUEDA POR NÚMERO DE ORDEN (OT)
     # ==========================================
-    # Buscamos columnas que representen órdenes de trabajo
-    columnas_ot = [c for c in df.columns if any(p in str(c).upper() for p in ["ORDEN", "NRO_ORDEN", "OT", "NUM_OT"])]
-    for col in columnas_ot:
-        # Extraemos números del texto de consulta para buscar coincidencias exactas de OT
-        numeros = re.findall(r'\b\d+\b', texto_limpio)
+    # Coincidencias exactas de OT: número → primera fila, por columna de OT
+    numeros = re.findall(r'\b\d+\b', texto_limpio)
+    for _, filas_por_numero in indice["ot"]:
         for num in numeros:
-            match_ot = df[df[col].astype(str).str.contains(num, na=False)]
-            if not match_ot.empty:
+            fila = filas_por_numero.get(num)
+            if fila is not None:
                 # Si encontramos la OT, retornamos el equipo asociado a esa OT
-                return match_ot[col_principal].iloc[0]
-
-
-
-    # 🔹 1. Búsqueda directa por código
-    coincidencias = df[
-        df[col_principal].astype(str).str.contains(texto, na=False)
-    ]
-
-    if not coincidencias.empty:
-        return coincidencias[col_principal].iloc[0]
-
-    # 🔹 2. Búsqueda por descripción
-    if "DESCRIPCION_EXTRAIDA" in df.columns:
-
-        if "DESC_NORM" in df.columns:
-           match = df[df["DESC_NORM"].str.contains(texto, na=False)]
-
-        match = df_temp[
-            df_temp["desc_norm"].str.contains(texto, na=False)
-        ]
-
-        if not match.empty:
-            return match[col_principal].iloc[0]
-
-    # 🔹 3. Búsqueda en TEXTO COMPLETO (🔥 NUEVO)
-    col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df.columns else "DESCRIPCIÓN DEL TRABAJO"
-
-    if col_texto in df.columns:
-
-        df_temp = df.copy()
-        df_temp["texto_norm"] = df_temp[col_texto].apply(normalizar)
-
-        match = df_temp[
-            df_temp["texto_norm"].str.contains(texto, na=False)
-        ]
-
-        if not match.empty:
-            return match[col_principal].iloc[0]
+                return equipos.iloc[fila]
+
+    # 🔹 2. Búsqueda directa por código
+    # 🔹 3. Búsqueda por descripción
+    for nombre in ["codigo", "desc"]:
+        if nombre in indice:
+            filas = indice[nombre].buscar(texto_limpio, limite=1)
+            if len(filas):
+                return equipos.iloc[filas[0]]
+
+    # 🔹 4. Búsqueda en TEXTO COMPLETO
+    if "texto" in indice:
+        fila = indice["texto"].primera_fila(texto_limpio)
+        if fila is not None:
+            return equipos.iloc[fila]
 
     return None
 
@@ -136,16 +115,12 @@ def generar_analisis_tecnico_avanzado(df, consulta):
     if "TEXTO_RAG_NORM" not in df.columns:
         return "No hay columna optimizada para análisis."
 
-    df_filtrado = df[
-        df["TEXTO_RAG_NORM"].str.contains(consulta, na=False)]
+    # 🧊 Conteos precalculados TEXTO_RAG_NORM × texto completo
+    conteo = textos_que_contienen(obtener_cubos(df), df, consulta)
 
-    if df_filtrado.empty:
+    if conteo is None or conteo.empty:
         return "No se encontraron eventos históricos similares."
 
-    col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df_filtrado.columns else "DESCRIPCIÓN DEL TRABAJO"
-
-    conteo = df_filtrado[col_texto].value_counts()
-
     respuesta = "Basado en historial, las intervenciones más frecuentes son:\n\n"
 
     for desc, cantidad in conteo.items():
@@ -157,6 +132,8 @@ def generar_analisis_tecnico_avanzado(df, consulta):
 # ==========================================
 # MOTOR ANALITICO PRINCIPAL
 # ==========================================
+# Todas las ramas responden desde los cubos de conteos materializados en
+# cada recarga de datos (core.cubos): cortes sobre celdas, sin recorrer filas.
 
 def ejecutar_analisis(df, texto):
 
@@ -169,16 +146,16 @@ def ejecutar_analisis(df, texto):
 
     col_principal = obtener_columna_principal(df)
 
+    cubos = obtener_cubos(df)
+
     # ==============================
     # ANALISIS POR TECNICO
     # ==============================
     if tipo == "tecnico":
 
-        col_tecnico = "DIA 1) TEC. N° 01"
+        top = cubos["conteos"].contar("tecnico")
 
-        if col_tecnico in df.columns:
-
-            top = df[col_tecnico].value_counts()
+        if top is not None:
 
             resultado["tipo"] = "ranking_tecnicos"
             resultado["data"] = top.to_dict()
@@ -188,10 +165,8 @@ def ejecutar_analisis(df, texto):
     # ==============================
     elif tipo == "falla":
 
-        col_texto = "TEXTO_RAG" if "TEXTO_RAG" in df.columns else None
-
-        if col_texto:
-           top = df[col_texto].value_counts().head(10)
+        if "fallas" in cubos:
+           top = cubos["fallas"].contar("falla").head(10)
 
            resultado["tipo"] = "ranking_fallas"
            resultado["data"] = top.to_dict()
@@ -205,24 +180,15 @@ def ejecutar_analisis(df, texto):
 
             equipo_detectado = detectar_equipo_desde_texto(df, texto)
 
-            if equipo_detectado:
-                df_filtrado = df[df[col_principal] == equipo_detectado]
-            else:
-                df_filtrado = df.copy()
-
-            if "FECHA (DÍA 01)" in df_filtrado.columns:
-                df_filtrado["FECHA (DÍA 01)"] = pd.to_datetime(
-                    df_filtrado["FECHA (DÍA 01)"], errors='coerce'
-                )
-
-            col_texto = "TEXTO_RAG" if "TEXTO_RAG" in df_filtrado.columns else None
+            filtros = {"equipo": equipo_detectado} if equipo_detectado else {}
 
-            if col_texto:
-               conteo = df_filtrado[col_texto].value_counts().head(10)
+            conteo = pd.Series(dtype=object)
+            if "fallas" in cubos:
+                conteo = cubos["fallas"].contar("falla", **filtros).head(10)
 
             resultado["tipo"] = "incidencias_equipo"
             resultado["equipo"] = equipo_detectado
-            resultado["total"] = len(df_filtrado)
+            resultado["total"] = cubos["conteos"].total(**filtros)
             resultado["tipos_trabajo"] = len(conteo)
             resultado["data"] = conteo.to_dict()
 
@@ -231,20 +197,9 @@ def ejecutar_analisis(df, texto):
     # ==============================
     elif tipo == "tendencia":
 
-        col_fecha = "FECHA (DÍA 01)"
-
-        if col_fecha in df.columns:
-
-            df_temp = df.copy()
-            df_temp[col_fecha] = pd.to_datetime(df_temp[col_fecha], errors='coerce')
-
-            df_temp["mes"] = df_temp[col_fecha].dt.to_period("M")
+        tendencia = cubos["conteos"].contar("mes", orden="etiqueta")
 
-            tendencia = (
-                df_temp["mes"]
-                .value_counts()
-                .sort_index()
-            )
+        if tendencia is not None:
 
             resultado["tipo"] = "tendencia_mensual"
             resultado["data"] = tendencia.astype(str).to_dict()
@@ -259,4 +214,4 @@ def ejecutar_analisis(df, texto):
         resultado["tipo"] = "general"
         resultado["data"] = {"total_registros": total}
 
-    return resultado
\ No newline at end of file
+    return resultado
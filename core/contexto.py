@@ -0,0 +1,103 @@
+import re
+
+
+# ==========================================
+# ESTIMADOR LOCAL DE TOKENS
+# ==========================================
+# Sin ida y vuelta a count_tokens: ~4 caracteres por token en texto latino,
+# con piso en número de palabras/símbolos (códigos, números y separadores
+# "|" suelen ir en tokens propios).
+
+_PIEZAS = re.compile(r"\w+|[^\w\s]")
+
+
+def estimar_tokens(texto):
+    if not texto:
+        return 0
+    return max((len(texto) + 3) // 4, len(_PIEZAS.findall(texto)) * 3 // 4)
+
+
+# ==========================================
+# ENSAMBLADOR DE CONTEXTO CON PRESUPUESTO
+# ==========================================
+# Cada sección trae fragmentos en orden de valor (el mejor primero) y una
+# prioridad. Se llenan las secciones por prioridad, fragmento a fragmento,
+# hasta agotar el presupuesto; el texto final respeta el orden de alta de
+# las secciones.
+
+class EnsambladorContexto:
+
+    def __init__(self, presupuesto):
+        self.presupuesto = presupuesto
+        self.secciones = []
+
+    def agregar(self, nombre, encabezado, fragmentos, prioridad, invertir=False, separador="\n"):
+        # invertir=True: se eligen del primero al último (p. ej. más reciente
+        # primero) pero se muestran en orden inverso (cronológico)
+        self.secciones.append({
+            "nombre": nombre,
+            "encabezado": encabezado,
+            "fragmentos": fragmentos,
+            "prioridad": prioridad,
+            "invertir": invertir,
+            "separador": separador,
+            "incluidos": [],
+            "tokens": 0,
+            "descartados": 0,
+        })
+
+    def ensamblar(self):
+
+        restante = self.presupuesto
+
+        for seccion in sorted(self.secciones, key=lambda s: s["prioridad"]):
+
+            costo_encabezado = estimar_tokens(seccion["encabezado"])
+
+            for fragmento in seccion["fragmentos"]:
+                if not fragmento:
+                    continue
+
+                costo = estimar_tokens(fragmento)
+                if not seccion["incluidos"]:
+                    costo += costo_encabezado
+
+                if costo > restante:
+                    # Corte de la sección: lo que sigue vale menos que esto
+                    seccion["descartados"] += 1
+                    break
+
+                seccion["incluidos"].append(fragmento)
+                seccion["tokens"] += costo
+                restante -= costo
+
+        bloques = []
+
+        for seccion in self.secciones:
+            if not seccion["incluidos"]:
+                continue
+
+            incluidos = seccion["incluidos"][::-1] if seccion["invertir"] else seccion["incluidos"]
+            bloques.append(seccion["encabezado"] + seccion["separador"].join(incluidos) + "\n")
+
+        return "".join(bloques), self.reporte()
+
+    def reporte(self):
+        return {
+            s["nombre"]: {
+                "tokens": s["tokens"],
+                "fragmentos": len(s["incluidos"]),
+                "cortado": s["descartados"] > 0,
+            }
+            for s in self.secciones
+        }
+
+
+def imprimir_reporte_contexto(reporte, presupuesto):
+
+    usados = sum(s["tokens"] for s in reporte.values())
+    print(f"📐 Contexto: {usados}/{presupuesto} tokens estimados")
+
+    for nombre, datos in reporte.items():
+        corte = " (recortado)" if datos["cortado"] else ""
+        print(f"   - {nombre}: {datos['tokens']} tokens, {datos['fragmentos']} fragmentos{corte}")
@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+
+from core.indices import construir_indice_invertido
+from core.insights import columna_mes, obtener_columna_principal
+
+
+# ==========================================
+# 🧊 CUBO DE CONTEOS
+# ==========================================
+# Se materializa una vez por versión de datos: cada celda es una combinación
+# presente de las dimensiones, con su número de filas y la primera fila en
+# que aparece. Contar por una dimensión filtrando otras recorre las celdas
+# (pocas) en vez de las filas del Sheet.
+# Orden del resultado = value_counts: conteo descendente y, en empates,
+# orden de aparición (o de categoría si la columna es categórica).
+# Dimensiones de texto largo (columnas_texto = {dimensión: columna}): no se
+# copian sus etiquetas, se guarda la primera fila de cada código y la
+# etiqueta se lee por posición del DataFrame en cache al contar.
+
+class CuboConteos:
+
+    def __init__(self, dimensiones, columnas_texto=None):
+
+        self.nombres = list(dimensiones)
+        self.columnas_texto = dict(columnas_texto or {})
+        self.etiquetas = {}
+        self.posiciones = {}
+        self.categoricas = {}
+        self.tamanos = {}
+        self.representantes = {}
+        self.valores = {}
+
+        codigos = []
+        tamanos = []
+
+        for nombre, serie in dimensiones.items():
+            categorica = isinstance(serie.dtype, pd.CategoricalDtype)
+            cod, etiquetas = pd.factorize(serie, sort=categorica)
+
+            # Código 0 = sin valor (NaN / NaT)
+            codigos.append(cod + 1)
+            tamanos.append(len(etiquetas) + 1)
+
+            self.tamanos[nombre] = len(etiquetas) + 1
+            self.categoricas[nombre] = categorica
+
+            if nombre in self.columnas_texto:
+                self.valores[nombre] = serie.array
+                continue
+
+            self.etiquetas[nombre] = np.asarray(etiquetas, dtype=object)
+            self.posiciones[nombre] = {e: k + 1 for k, e in enumerate(self.etiquetas[nombre])}
+
+        total_filas = len(codigos[0]) if codigos else 0
+        celda = np.ravel_multi_index(codigos, tamanos) if codigos else np.zeros(0, dtype=np.int64)
+
+        ids, inversa, self.conteos = np.unique(celda, return_inverse=True, return_counts=True)
+
+        self.primeras = np.full(len(ids), total_filas, dtype=np.int64)
+        np.minimum.at(self.primeras, inversa, np.arange(total_filas))
+
+        coordenadas = np.unravel_index(ids, tamanos) if codigos else []
+        self.celdas = dict(zip(self.nombres, coordenadas))
+
+        # Primera fila de cada código de las dimensiones de texto
+        for nombre in self.columnas_texto:
+            primeras = np.full(self.tamanos[nombre], total_filas, dtype=np.int64)
+            np.minimum.at(primeras, self.celdas[nombre], self.primeras)
+            self.representantes[nombre] = primeras
+
+        # Cortes ya calculados (el cubo no cambia hasta la próxima recarga)
+        self.memo = {}
+
+    # Las columnas de texto van en el Feather: al restaurar el snapshot se
+    # vuelven a enlazar con enlazar(df)
+    def __getstate__(self):
+        estado = dict(self.__dict__)
+        estado["valores"] = {}
+        return estado
+
+    def enlazar(self, df):
+        self.valores = {nombre: df[col].array for nombre, col in self.columnas_texto.items()}
+
+    def _etiquetas(self, nombre, codigos):
+        if nombre in self.columnas_texto:
+            filas = self.representantes[nombre][codigos]
+            return np.asarray(self.valores[nombre].take(filas), dtype=object)
+        return self.etiquetas[nombre][codigos - 1]
+
+    def _mascara(self, filtros):
+
+        mascara = np.ones(len(self.conteos), dtype=bool)
+
+        for nombre, valor in filtros.items():
+            posiciones = self.posiciones[nombre]
+            if isinstance(valor, (list, tuple, set, np.ndarray)):
+                codigos = [posiciones[v] for v in valor if v in posiciones]
+                mascara &= np.isin(self.celdas[nombre], codigos)
+            else:
+                mascara &= self.celdas[nombre] == posiciones.get(valor, -1)
+
+        return mascara
+
+    def total(self, **filtros):
+        return int(self.conteos[self._mascara(filtros)].sum())
+
+    def contar(self, por, orden="conteo", **filtros):
+
+        if por not in self.celdas or any(n not in self.posiciones for n in filtros):
+            return None
+
+        # Solo se memorizan cortes con filtros escalares (equipo, mes, ...)
+        clave = None
+        if all(not isinstance(v, (list, tuple, set, np.ndarray)) for v in filtros.values()):
+            clave = (por, orden, tuple(sorted(filtros.items())))
+            if clave in self.memo:
+                return self.memo[clave]
+
+        mascara = self._mascara(filtros)
+        codigos = self.celdas[por][mascara]
+        tamano = self.tamanos[por]
+
+        conteos = np.bincount(codigos, weights=self.conteos[mascara], minlength=tamano).astype(np.int64)
+
+        primeras = np.full(tamano, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(primeras, codigos, self.primeras[mascara])
+
+        # Sin el código 0 (sin valor) ni etiquetas que no aparecen en el corte
+        presentes = np.flatnonzero(conteos[1:]) + 1
+
+        if orden == "etiqueta":
+            resultado = pd.Series(conteos[presentes], index=self._etiquetas(por, presentes)).sort_index()
+        else:
+            desempate = presentes if self.categoricas[por] else primeras[presentes]
+            elegidos = presentes[np.lexsort((desempate, -conteos[presentes]))]
+            resultado = pd.Series(conteos[elegidos], index=self._etiquetas(por, elegidos))
+
+        if clave is not None:
+            self.memo[clave] = resultado
+
+        return resultado
+
+
+# ==========================================
+# 🧊 CUBOS DEL MOTOR ANALÍTICO
+# ==========================================
+#   conteos → equipo × mes × tipo de mantenimiento × técnico
+#   fallas  → equipo × TEXTO_RAG (ranking de trabajos, global o por equipo)
+#   textos  → texto completo; las filas cuyo TEXTO_RAG_NORM contiene una
+#             consulta libre salen del índice invertido de búsqueda (el
+#             mismo indice_busqueda["texto"], no se arma otro)
+
+COLUMNA_TECNICO = "DIA 1) TEC. N° 01"
+COLUMNA_FECHA = "FECHA (DÍA 01)"
+
+
+def construir_cubos(df, indice_texto=None):
+
+    if df is None or df.empty:
+        return {}
+
+    col_principal = obtener_columna_principal(df)
+    equipos = df[col_principal] if col_principal else None
+
+    dimensiones = {}
+
+    if equipos is not None:
+        dimensiones["equipo"] = equipos
+    if COLUMNA_FECHA in df.columns:
+        dimensiones["mes"] = columna_mes(df)
+    if "TIPO DE MANTENIMIENTO" in df.columns:
+        dimensiones["tipo"] = df["TIPO DE MANTENIMIENTO"]
+    if COLUMNA_TECNICO in df.columns:
+        dimensiones["tecnico"] = df[COLUMNA_TECNICO]
+
+    cubos = {"conteos": CuboConteos(dimensiones), "total": len(df)}
+
+    if "TEXTO_RAG" in df.columns:
+        fallas = {"falla": df["TEXTO_RAG"]}
+        if equipos is not None:
+            fallas["equipo"] = equipos
+        cubos["fallas"] = CuboConteos(fallas, columnas_texto={"falla": "TEXTO_RAG"})
+
+    col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df.columns else "DESCRIPCIÓN DEL TRABAJO"
+
+    if "TEXTO_RAG_NORM" in df.columns and col_texto in df.columns:
+        cubos["textos"] = CuboConteos({"texto": df[col_texto]}, columnas_texto={"texto": col_texto})
+        # Fuera del snapshot (DataFrame filtrado) no hay índice que compartir
+        if indice_texto is None:
+            indice_texto = construir_indice_invertido(df["TEXTO_RAG_NORM"])
+        cubos["indice_texto"] = indice_texto
+
+    return cubos
+
+
+def enlazar_cubos(cubos, df):
+    for cubo in cubos.values():
+        if isinstance(cubo, CuboConteos):
+            cubo.enlazar(df)
+
+
+def textos_que_contienen(cubos, df, consulta):
+
+    # Conteos del texto completo en las filas cuyo TEXTO_RAG_NORM contiene la consulta
+    if "textos" not in cubos:
+        return None
+
+    if not consulta:
+        return cubos["textos"].contar("texto")
+
+    # Una fila que contiene la consulta contiene cada palabra dentro de
+    # algún token: el índice acota las filas y se verifica la frase completa
+    filas = None
+    for p in consulta.split():
+        encontradas = cubos["indice_texto"].buscar(p)
+        filas = encontradas if filas is None else np.intersect1d(filas, encontradas, assume_unique=True)
+
+    if filas is None or not len(filas):
+        return pd.Series(dtype=np.int64)
+
+    filas = filas[df["TEXTO_RAG_NORM"].iloc[filas].str.contains(consulta, regex=False, na=False).to_numpy()]
+
+    # Mismo orden que el cubo: conteo descendente, empates por aparición
+    # (o por categoría)
+    serie = df[cubos["textos"].columnas_texto["texto"]].iloc[filas]
+    codigos, textos = pd.factorize(serie, sort=isinstance(serie.dtype, pd.CategoricalDtype))
+    conteos = np.bincount(codigos[codigos >= 0], minlength=len(textos))
+    orden = np.lexsort((np.arange(len(textos)), -conteos))
+
+    return pd.Series(conteos[orden], index=np.asarray(textos, dtype=object)[orden])
@@ -0,0 +1,418 @@
+import re
+from collections import deque, defaultdict
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+
+from core.texto import normalizar_simbolos
+
+
+# ==========================================
+# 🔥 AUTÓMATA AHO-CORASICK
+# ==========================================
+# Busca todos los patrones contenidos en un texto en una sola pasada:
+# el costo depende del largo del texto, no de la cantidad de patrones.
+
+class AutomataAhoCorasick:
+
+    def __init__(self):
+        self.transiciones = [{}]
+        self.fallo = [0]
+        self.salidas = [[]]
+        self.valores = {}
+
+    def agregar(self, patron, valor):
+        if not patron:
+            return
+
+        nodo = 0
+        for c in patron:
+            siguiente = self.transiciones[nodo].get(c)
+            if siguiente is None:
+                siguiente = len(self.transiciones)
+                self.transiciones[nodo][c] = siguiente
+                self.transiciones.append({})
+                self.fallo.append(0)
+                self.salidas.append([])
+            nodo = siguiente
+
+        if patron not in self.valores:
+            self.salidas[nodo].append(patron)
+        self.valores[patron] = valor
+
+    def construir(self):
+        cola = deque(self.transiciones[0].values())
+
+        while cola:
+            nodo = cola.popleft()
+            for c, hijo in self.transiciones[nodo].items():
+                cola.append(hijo)
+
+                f = self.fallo[nodo]
+                while f and c not in self.transiciones[f]:
+                    f = self.fallo[f]
+
+                destino = self.transiciones[f].get(c, 0)
+                self.fallo[hijo] = destino if destino != hijo else 0
+                self.salidas[hijo] = self.salidas[hijo] + self.salidas[self.fallo[hijo]]
+
+        return self
+
+    def buscar(self, texto):
+        nodo = 0
+        for c in texto:
+            while nodo and c not in self.transiciones[nodo]:
+                nodo = self.fallo[nodo]
+            nodo = self.transiciones[nodo].get(c, 0)
+
+            for patron in self.salidas[nodo]:
+                yield patron, self.valores[patron]
+
+
+# ==========================================
+# 🔧 ÍNDICE DE EQUIPOS (CÓDIGO / DESCRIPCIÓN)
+# ==========================================
+# Cada patrón guarda (posición de la primera fila donde aparece, código a
+# devolver). Gana la coincidencia de la fila más temprana, igual que el
+# recorrido fila por fila: en la misma fila el código tiene prioridad.
+
+def construir_indice_equipos(df):
+
+    automata = AutomataAhoCorasick()
+
+    if df is None or df.empty:
+        return automata.construir()
+
+    tiene_codigo = "CODIGO_EXTRAIDO" in df.columns
+    tiene_desc = "DESCRIPCION_EXTRAIDA" in df.columns
+
+    codigos = df["CODIGO_EXTRAIDO"].tolist() if tiene_codigo else [None] * len(df)
+    descripciones = df["DESCRIPCION_EXTRAIDA"].tolist() if tiene_desc else [None] * len(df)
+
+    for pos, (codigo, desc) in enumerate(zip(codigos, descripciones)):
+
+        codigo_txt = str(codigo).lower() if tiene_codigo else ""
+        desc_txt = str(desc).lower() if tiene_desc else ""
+
+        if codigo_txt and codigo_txt not in automata.valores:
+            automata.agregar(codigo_txt, (pos, 0, codigo))
+
+        if desc_txt and desc_txt not in automata.valores:
+            automata.agregar(desc_txt, (pos, 1, codigo))
+
+    return automata.construir()
+
+
+def buscar_equipo(indice, texto):
+
+    if indice is None or not texto:
+        return None
+
+    mejor = None
+
+    for _, valor in indice.buscar(texto.lower()):
+        if mejor is None or valor[:2] < mejor[:2]:
+            mejor = valor
+
+    return mejor[2] if mejor else None
+
+
+# ==========================================
+# 🔎 ÍNDICE DE SUBCADENAS (TRIGRAMAS)
+# ==========================================
+# Responde "¿qué filas tienen un valor que contiene q?" sin recorrer la
+# columna: trigramas → claves candidatas → verificación → posting lists.
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _agrupar_posiciones(codigos, total_claves):
+    # codigos[i] = clave de la fila i (-1 = sin clave) → lista de filas por clave
+    orden = np.argsort(codigos, kind="stable")
+    codigos_ordenados = codigos[orden]
+    cortes = np.searchsorted(codigos_ordenados, np.arange(total_claves + 1))
+    return [orden[cortes[k]:cortes[k + 1]] for k in range(total_claves)]
+
+
+class IndiceSubcadenas:
+
+    def __init__(self, claves, postings, total_filas):
+        self.claves = claves
+        self.postings = postings
+        self.total_filas = total_filas
+
+        self.trigramas = defaultdict(list)
+        for k, clave in enumerate(claves):
+            for t in _trigramas(clave):
+                self.trigramas[t].append(k)
+
+        self.trigramas = {t: np.array(ks) for t, ks in self.trigramas.items()}
+
+    @classmethod
+    def desde_serie(cls, serie):
+        codigos, uniques = pd.factorize(serie.astype(str))
+        postings = _agrupar_posiciones(codigos, len(uniques))
+        return cls(list(uniques), postings, len(serie))
+
+    def claves_que_contienen(self, q):
+
+        if len(q) < 3:
+            return [k for k, clave in enumerate(self.claves) if q in clave]
+
+        candidatos = None
+        for t in sorted(_trigramas(q), key=lambda t: len(self.trigramas.get(t, ()))):
+            ks = self.trigramas.get(t)
+            if ks is None:
+                return []
+            candidatos = ks if candidatos is None else np.intersect1d(candidatos, ks, assume_unique=True)
+            if len(candidatos) == 0:
+                return []
+
+        return [k for k in candidatos if q in self.claves[k]]
+
+    def buscar(self, q, limite=None):
+
+        # Las posting lists están ordenadas: las primeras `limite` filas de la
+        # unión salen de las primeras `limite` de cada lista
+        if not q:
+            return np.arange(self.total_filas)[:limite]
+
+        ks = self.claves_que_contienen(q)
+
+        if not ks:
+            return np.array([], dtype=np.int64)
+
+        return np.unique(np.concatenate([self.postings[k][:limite] for k in ks]))[:limite]
+
+
+# ==========================================
+# 📚 ÍNDICE INVERTIDO (TOKEN → FILAS)
+# ==========================================
+# Una palabra sin espacios está contenida en un texto sii está contenida en
+# alguno de sus tokens: basta buscar en el vocabulario, no en las filas.
+
+def construir_indice_invertido(serie):
+
+    tokens = serie.astype(str).str.split()
+    largos = tokens.str.len().to_numpy()
+
+    filas = np.repeat(np.arange(len(serie)), largos)
+    codigos, vocabulario = pd.factorize(tokens.explode().dropna())
+
+    pares = np.unique(np.stack([codigos, filas]), axis=1) if len(filas) else np.empty((2, 0), dtype=np.int64)
+    cortes = np.searchsorted(pares[0], np.arange(len(vocabulario) + 1))
+    postings = [pares[1, cortes[k]:cortes[k + 1]] for k in range(len(vocabulario))]
+
+    return IndiceSubcadenas(list(vocabulario), postings, len(serie))
+
+
+def construir_indice_busqueda(df):
+
+    indice = {}
+
+    for nombre, col in [("codigo", "CODIGO_NORM"), ("desc", "DESC_NORM")]:
+        if col in df.columns:
+            indice[nombre] = IndiceSubcadenas.desde_serie(df[col])
+
+    if "TEXTO_RAG_NORM" in df.columns:
+        indice["texto"] = construir_indice_invertido(df["TEXTO_RAG_NORM"])
+        indice["bm25"] = construir_bm25(df["TEXTO_RAG_NORM"])
+
+    return indice
+
+
+# ==========================================
+# 🏆 RANKING BM25
+# ==========================================
+# Matriz dispersa filas × términos con los pesos BM25 ya aplicados: rankear
+# una consulta es un único producto matriz-vector.
+
+def construir_bm25(serie, k1=1.5, b=0.75):
+
+    vectorizador = CountVectorizer(
+        tokenizer=str.split,
+        token_pattern=None,
+        lowercase=False
+    )
+
+    try:
+        tf = vectorizador.fit_transform(serie.astype(str)).tocsr().astype(np.float64)
+    except ValueError:
+        # Vocabulario vacío (hoja sin texto)
+        return None
+
+    largos = np.asarray(tf.sum(axis=1)).ravel()
+    promedio = largos.mean() or 1.0
+
+    df_terminos = np.bincount(tf.indices, minlength=tf.shape[1])
+    idf = np.log(1 + (tf.shape[0] - df_terminos + 0.5) / (df_terminos + 0.5))
+
+    # tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)), fila por fila
+    norma = np.repeat(k1 * (1 - b + b * largos / promedio), np.diff(tf.indptr))
+    tf.data = tf.data * (k1 + 1) / (tf.data + norma)
+    matriz = tf.multiply(idf).tocsr()
+
+    return {"vectorizador": vectorizador, "matriz": matriz}
+
+
+def rankear_bm25(modelo, q, k=5):
+
+    if modelo is None or not q:
+        return np.array([], dtype=np.int64)
+
+    consulta = modelo["vectorizador"].transform([q])
+    consulta.data[:] = 1
+
+    scores = (modelo["matriz"] @ consulta.T).toarray().ravel()
+
+    positivos = np.flatnonzero(scores > 0)
+    if len(positivos) > k:
+        umbral = np.partition(scores[positivos], len(positivos) - k)[len(positivos) - k]
+        positivos = positivos[scores[positivos] >= umbral]
+
+    # Mayor score primero; a igual score, orden de la hoja
+    return positivos[np.lexsort((positivos, -scores[positivos]))][:k]
+
+
+# ==========================================
+# 🗂️ PARTICIONES POR EQUIPO
+# ==========================================
+# Filas de cada código: las que lo tienen como código más las que lo
+# mencionan en la descripción del equipo o del trabajo (sin distinguir
+# mayúsculas). Las menciones se encuentran con un solo barrido Aho-Corasick
+# por texto distinto, en vez de un str.contains por equipo.
+
+def construir_particiones_equipo(df, col_equipo):
+
+    if df is None or df.empty or col_equipo not in df.columns:
+        return {}
+
+    codigos, equipos = pd.factorize(df[col_equipo].astype(str))
+    filas_equipo = _agrupar_posiciones(codigos, len(equipos))
+
+    particiones = {eq: [filas] for eq, filas in zip(equipos, filas_equipo)}
+
+    automata = AutomataAhoCorasick()
+    for eq in equipos:
+        if eq:
+            automata.agregar(eq.lower(), eq)
+    automata.construir()
+
+    columnas_texto = [c for c in ["DESCRIPCION_EXTRAIDA", "DESCRIPCIÓN DEL TRABAJO"] if c in df.columns]
+
+    for col in columnas_texto:
+        codigos_texto, textos = pd.factorize(df[col].astype(str))
+        filas_texto = _agrupar_posiciones(codigos_texto, len(textos))
+
+        for texto, filas in zip(textos, filas_texto):
+            for eq in {valor for _, valor in automata.buscar(texto.lower())}:
+                particiones[eq].append(filas)
+
+    return {
+        eq: np.unique(np.concatenate(partes)) if len(partes) > 1 else partes[0]
+        for eq, partes in particiones.items()
+    }
+
+
+# ==========================================
+# 🔎 ÍNDICE DEL MOTOR ANALÍTICO (OT / CÓDIGO / TEXTO)
+# ==========================================
+# Para detectar_equipo_desde_texto: número de OT → fila en un dict por
+# columna, y "¿qué filas contienen la consulta?" sobre los valores
+# normalizados conservando guiones (minúsculas, sin acentos). Solo cuentan
+# filas con equipo: son las únicas que pueden devolver uno.
+
+PALABRAS_OT = ["ORDEN", "NRO_ORDEN", "OT", "NUM_OT"]
+
+_NUMERO = re.compile(r"\b\d+\b")
+
+
+def columnas_orden_trabajo(df):
+    return [c for c in df.columns if any(p in str(c).upper() for p in PALABRAS_OT)]
+
+
+def _factorizar_normalizado(serie, validas):
+    # Cada valor distinto se normaliza una vez; filas sin equipo → sin clave
+    codigos, uniques = pd.factorize(serie, use_na_sentinel=False)
+    codigos = np.where(validas, codigos, -1)
+    return codigos, [normalizar_simbolos(v) for v in uniques]
+
+
+def _indice_ot(serie, validas):
+
+    codigos, valores = _factorizar_normalizado(serie, validas)
+
+    # Primera fila de cada valor distinto
+    primera = np.full(len(valores), len(serie), dtype=np.int64)
+    con_clave = codigos >= 0
+    np.minimum.at(primera, codigos[con_clave], np.flatnonzero(con_clave))
+
+    # Recorrido en orden de fila: cada número queda con la fila más temprana
+    mapa = {}
+    for k in np.argsort(primera, kind="stable"):
+        if primera[k] == len(serie):
+            break
+        for num in _NUMERO.findall(valores[k]):
+            mapa.setdefault(num, int(primera[k]))
+
+    return mapa
+
+
+class IndiceTextos:
+
+    # Textos largos (uno por valor distinto): índice invertido sobre sus
+    # tokens para acotar candidatos y verificación de la frase completa
+    def __init__(self, serie, validas):
+        codigos, self.textos = _factorizar_normalizado(serie, validas)
+        self.filas = _agrupar_posiciones(codigos, len(self.textos))
+        self.tokens = construir_indice_invertido(pd.Series(self.textos, dtype=object))
+
+    def claves_que_contienen(self, q):
+
+        palabras = q.split()
+
+        if not palabras:
+            return []
+
+        # Un texto que contiene q contiene cada palabra de q dentro de algún token
+        candidatos = None
+        for p in palabras:
+            ks = self.tokens.buscar(p)
+            candidatos = ks if candidatos is None else np.intersect1d(candidatos, ks, assume_unique=True)
+            if len(candidatos) == 0:
+                return []
+
+        return [k for k in candidatos if q in self.textos[k]]
+
+    def primera_fila(self, q):
+
+        primeras = [self.filas[k][0] for k in self.claves_que_contienen(q) if len(self.filas[k])]
+
+        return int(min(primeras)) if primeras else None
+
+
+def construir_indice_analisis(df, col_equipo):
+
+    if df is None or col_equipo not in df.columns:
+        return {}
+
+    equipos = df[col_equipo]
+    validas = (equipos.notna() & (equipos.astype(str).str.strip() != "")).to_numpy()
+
+    indice = {
+        "ot": [(col, _indice_ot(df[col], validas)) for col in columnas_orden_trabajo(df)],
+    }
+
+    for nombre, col in [("codigo", col_equipo), ("desc", "DESCRIPCION_EXTRAIDA")]:
+        if col in df.columns:
+            codigos, valores = _factorizar_normalizado(df[col], validas)
+            indice[nombre] = IndiceSubcadenas(valores, _agrupar_posiciones(codigos, len(valores)), len(df))
+
+    col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df.columns else "DESCRIPCIÓN DEL TRABAJO"
+
+    if col_texto in df.columns:
+        indice["texto"] = IndiceTextos(df[col_texto], validas)
+
+    return indice
@@ -1,12 +1,41 @@
+import os
+import threading
+import time
+
+import numpy as np
 import pandas as pd
-import unicodedata
-import re
+import scipy.sparse as sp
+
+from core.texto import ConcatenadorColumnas
+
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.cluster import MiniBatchKMeans
+
+# 🔥 Memoria global: se reemplaza completa al publicar (nunca por partes)
+ESTADO_INSIGHTS = {
+    "insights": {},
+    "version": None,
+    "generado": 0,
+    "tiempos": {},
+}
+
+# Un cálculo a la vez; si llega una versión más nueva, la vieja no se publica
+_lock_insights = threading.Lock()
+_version_pedida = None
+
+
+def _marcador(tiempos):
+
+    # marcar(etapa) guarda los segundos desde la marca anterior
+    ultimo = [time.perf_counter()]
+
+    def marcar(etapa):
+        ahora = time.perf_counter()
+        tiempos[etapa] = round(ahora - ultimo[0], 3)
+        ultimo[0] = ahora
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
+    return marcar
 
-# 🔥 Memoria global
-INSIGHTS = {}
 
 # ==========================================
 # NORMALIZADOR
@@ -18,18 +47,7 @@ def obtener_columna_principal(df):
         return "DESCRIPCION_EXTRAIDA"
     return None
 
-def normalizar(texto):
-    if not texto:
-        return ""
-    texto = str(texto).lower()
-    texto = "".join(
-        c for c in unicodedata.normalize('NFD', texto)
-        if unicodedata.category(c) != 'Mn'
-    )
-    texto = re.sub(r'[^a-z0-9\s]', '', texto)
-    return texto.strip()
-
-def construir_texto_completo(df):
+def construir_texto_completo(df, concatenador=None):
 
     columnas_base = []
 
@@ -44,20 +62,191 @@ def construir_texto_completo(df):
     if not columnas_usar:
         return df
 
-    df = df.copy()
+    # Al cargar el Sheet: se agrega sobre el mismo DataFrame junto con TEXTO_RAG
+    if concatenador is not None:
+        df["TEXTO_COMPLETO"] = concatenador.concatenar_normalizado(columnas_usar, " ")
+        return df
+
+    # Ya construido en la carga de datos
+    if "TEXTO_COMPLETO" in df.columns:
+        return df
 
-    df["TEXTO_COMPLETO"] = (
-        df[columnas_usar]
-        .fillna("")
-        .astype(str)
-        .agg(" ".join, axis=1)
-        .apply(normalizar)
+    # assign: DataFrame nuevo con la columna extra, sin copia profunda
+    return df.assign(
+        TEXTO_COMPLETO=ConcatenadorColumnas(df).concatenar_normalizado(columnas_usar, " ")
     )
 
-    return df
 
+def columna_mes(df):
+
+    # Mes (Period "M") de cada fila; NaT donde la fecha no se puede leer
+    fechas = pd.to_datetime(df["FECHA (DÍA 01)"], errors="coerce")
+    return fechas.dt.to_period("M").rename("mes")
 
-def detectar_anomalias(df):
+
+# ==========================================
+# 🚨 LÍNEA BASE DE ANOMALÍAS (EQUIPOS × MESES)
+# ==========================================
+# Cada equipo se compara contra su propia línea base de conteos mensuales:
+#   global  → media/desviación de todos los meses (incluido el último)
+#   rolling → últimos `ventana` meses cerrados
+#   ewma    → media/varianza exponencial de los meses cerrados (span = ventana)
+# El estado se guarda sobre los meses cerrados (todos menos el último, que
+# sigue llenándose) y un mes nuevo se incorpora en O(equipos).
+
+MODO_ANOMALIAS = os.getenv("ANOMALIAS_MODO", "global")
+VENTANA_ANOMALIAS = int(os.getenv("ANOMALIAS_VENTANA", "6"))
+
+
+class LineaBaseAnomalias:
+
+    def __init__(self, modo="global", ventana=6):
+        self.modo = modo
+        self.ventana = ventana
+        self.alfa = 2 / (ventana + 1)
+
+        self.meses = []
+        self.equipos = pd.Index([])
+        # Conteos de los meses cerrados ya incorporados (equipos × meses)
+        self.historia = np.zeros((0, 0), dtype=np.int64)
+
+        # global: sumas exactas (enteros en float64); ewma: media y varianza
+        self.suma = np.zeros(0)
+        self.suma_cuadrados = np.zeros(0)
+        self.media_ewm = np.zeros(0)
+        self.var_ewm = np.zeros(0)
+
+    def _alinear(self, equipos):
+
+        # Equipos nuevos entran con historia en cero (exacto para los tres modos)
+        if self.equipos.equals(equipos):
+            return
+
+        posiciones = self.equipos.get_indexer(equipos)
+        existe = posiciones >= 0
+
+        def reindexar(valores):
+            nuevo = np.zeros((len(equipos),) + valores.shape[1:], dtype=valores.dtype)
+            nuevo[existe] = valores[posiciones[existe]]
+            return nuevo
+
+        self.historia = reindexar(self.historia)
+        self.suma = reindexar(self.suma)
+        self.suma_cuadrados = reindexar(self.suma_cuadrados)
+        self.media_ewm = reindexar(self.media_ewm)
+        self.var_ewm = reindexar(self.var_ewm)
+        self.equipos = equipos
+
+    def agregar_mes(self, mes, conteos):
+
+        # conteos: Series equipo → eventos del mes
+        self._alinear(self.equipos.union(conteos.index, sort=False))
+        x = conteos.reindex(self.equipos, fill_value=0).to_numpy(dtype=np.int64)
+
+        if self.modo == "ewma":
+            if self.meses:
+                diferencia = x - self.media_ewm
+                incremento = self.alfa * diferencia
+                self.media_ewm = self.media_ewm + incremento
+                self.var_ewm = (1 - self.alfa) * (self.var_ewm + diferencia * incremento)
+            else:
+                self.media_ewm = x.astype("float64")
+                self.var_ewm = np.zeros(len(x))
+
+        self.suma = self.suma + x
+        self.suma_cuadrados = self.suma_cuadrados + x.astype("float64") ** 2
+        self.historia = np.column_stack([self.historia, x]) if self.meses else x[:, None]
+        self.meses.append(mes)
+
+    def ajustar(self, tabla_cerrada):
+
+        # Desde cero: todo vectorizado salvo la recurrencia EWMA (un paso por mes)
+        self.meses = []
+        self.equipos = tabla_cerrada.index
+        matriz = tabla_cerrada.to_numpy(dtype=np.int64)
+        self.historia = matriz.reshape(len(self.equipos), -1)
+        self.suma = matriz.sum(axis=1).astype("float64")
+        self.suma_cuadrados = (matriz.astype("float64") ** 2).sum(axis=1)
+        self.media_ewm = np.zeros(len(self.equipos))
+        self.var_ewm = np.zeros(len(self.equipos))
+
+        if self.modo == "ewma":
+            for k in range(matriz.shape[1]):
+                x = matriz[:, k]
+                if k == 0:
+                    self.media_ewm = x.astype("float64")
+                    continue
+                diferencia = x - self.media_ewm
+                incremento = self.alfa * diferencia
+                self.media_ewm = self.media_ewm + incremento
+                self.var_ewm = (1 - self.alfa) * (self.var_ewm + diferencia * incremento)
+
+        self.meses = list(tabla_cerrada.columns)
+
+    def coincide(self, tabla_cerrada):
+
+        # El estado sirve si sus meses son un prefijo de los cerrados y esos
+        # meses no cambiaron (filas editadas o borradas fuerzan reajuste)
+        k = len(self.meses)
+        if not k or k > tabla_cerrada.shape[1] or list(tabla_cerrada.columns[:k]) != self.meses:
+            return False
+
+        equipos = self.equipos.union(tabla_cerrada.index, sort=False)
+        previo = pd.DataFrame(self.historia, index=self.equipos).reindex(equipos, fill_value=0)
+        actual = tabla_cerrada.iloc[:, :k].reindex(equipos, fill_value=0)
+
+        return np.array_equal(previo.to_numpy(), actual.to_numpy())
+
+    def puntuar(self, ultimo):
+
+        # Media y desviación de la línea base para cada equipo de `ultimo`
+        self._alinear(self.equipos.union(ultimo.index, sort=False))
+        posiciones = self.equipos.get_indexer(ultimo.index)
+        x = ultimo.to_numpy(dtype="float64")
+
+        if self.modo == "rolling":
+            ventana = self.historia[posiciones, -self.ventana:].astype("float64")
+            promedio = ventana.mean(axis=1)
+            desviacion = ventana.std(axis=1, ddof=1) if ventana.shape[1] > 1 else np.zeros(len(x))
+
+        elif self.modo == "ewma":
+            promedio = self.media_ewm[posiciones]
+            desviacion = np.sqrt(self.var_ewm[posiciones])
+
+        else:
+            # Incluye el último mes (regla original); sumas de enteros exactas
+            n = len(self.meses) + 1
+            suma = self.suma[posiciones] + x
+            suma_cuadrados = self.suma_cuadrados[posiciones] + x ** 2
+            promedio = suma / n
+            varianza = np.maximum(n * suma_cuadrados - suma ** 2, 0) / (n * (n - 1))
+            desviacion = np.sqrt(varianza)
+
+        return promedio, desviacion
+
+
+# Línea base del último cálculo: el siguiente refresco solo suma meses nuevos
+_linea_base = None
+
+
+def obtener_linea_base(tabla_cerrada, modo, ventana):
+
+    global _linea_base
+
+    linea = _linea_base
+
+    if linea is None or (linea.modo, linea.ventana) != (modo, ventana) or not linea.coincide(tabla_cerrada):
+        linea = LineaBaseAnomalias(modo, ventana)
+        linea.ajustar(tabla_cerrada)
+    else:
+        for mes in tabla_cerrada.columns[len(linea.meses):]:
+            linea.agregar_mes(mes, tabla_cerrada[mes])
+
+    _linea_base = linea
+    return linea
+
+
+def detectar_anomalias(df, mes=None, modo=None, ventana=None):
 
     if df is None or df.empty:
         return {}
@@ -67,52 +256,47 @@ def detectar_anomalias(df):
     if "FECHA (DÍA 01)" not in df.columns or col_principal is None:
         return {}
 
-    df_temp = df.copy()
+    if mes is None:
+        mes = columna_mes(df)
 
-    # Asegurar fecha
-
-    df_temp["FECHA (DÍA 01)"] = pd.to_datetime(
-        df_temp["FECHA (DÍA 01)"], errors="coerce"
-    )
-
-    df_temp["mes"] = df_temp["FECHA (DÍA 01)"].dt.to_period("M")
+    modo = modo or MODO_ANOMALIAS
+    ventana = ventana or VENTANA_ANOMALIAS
 
     tabla = (
-        df_temp.groupby([col_principal, "mes"])
+        df.groupby([df[col_principal], mes], observed=True)
         .size()
         .unstack(fill_value=0)
     )
 
-    anomalias = {}
-
-    for equipo in tabla.index:
-
-        serie = tabla.loc[equipo]
+    # Hacen falta al menos 3 meses (2 cerrados + el actual)
+    if tabla.shape[1] < 3:
+        return {}
 
-        if len(serie) < 3:
-            continue
+    linea = obtener_linea_base(tabla.iloc[:, :-1], modo, ventana)
 
-        promedio = serie.mean()
-        std = serie.std()
-        ultimo = serie.iloc[-1]
+    ultimo = tabla.iloc[:, -1]
+    promedio, desviacion = linea.puntuar(ultimo)
 
-        # 🔥 Regla de anomalía
+    # 🔥 Regla de anomalía: z-score de todo el último mes en una operación
+    valores = ultimo.to_numpy(dtype="float64")
+    con_desviacion = desviacion > 0
+    z_score = np.zeros(len(valores))
+    z_score[con_desviacion] = (valores - promedio)[con_desviacion] / desviacion[con_desviacion]
 
-        if std == 0:
-            continue
+    anomalias = {}
 
-        z_score = (ultimo - promedio) / std
+    for pos in np.flatnonzero(con_desviacion & (z_score > 2)):
 
-        if z_score > 2:
+        z = float(z_score[pos])
 
-            anomalias[equipo] = {
-                "tipo": "incremento_anormal",
-                "valor_actual": int(ultimo),
-                "promedio": round(promedio, 2),
-                "desviacion": round(std, 2),
-                "z_score": round(z_score, 2),
-                "nivel": "ALTO" if z_score > 3 else "MEDIO"
-            }
+        anomalias[tabla.index[pos]] = {
+            "tipo": "incremento_anormal",
+            "valor_actual": int(valores[pos]),
+            "promedio": round(float(promedio[pos]), 2),
+            "desviacion": round(float(desviacion[pos]), 2),
+            "z_score": round(z, 2),
+            "nivel": "ALTO" if z > 3 else "MEDIO"
+        }
 
     return anomalias
 
@@ -120,6 +304,93 @@ def detectar_anomalias(df):
 # ==========================================
 # 🔥 CLUSTERING INTELIGENTE
 # ==========================================
+# Vocabulario por hashing: no hay vocabulario que ajustar ni guardar, y los
+# centroides siguen valiendo de un refresco al siguiente
+VECTORIZADOR_CLUSTERS = HashingVectorizer(
+    ngram_range=(1, 2),
+    n_features=2 ** 16,
+    alternate_sign=False,
+    norm="l2"
+)
+
+LOTE_CLUSTERS = 4096
+
+
+class MotorClusters:
+
+    def __init__(self, n_clusters=8, pases=2, random_state=42):
+        self.n_clusters = n_clusters
+        self.pases = pases
+        self.modelo = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            batch_size=LOTE_CLUSTERS,
+            random_state=random_state
+        )
+        self.random_state = random_state
+        self.ajustado = False
+        # Hash de cada texto ya incorporado → cluster asignado (estable entre refrescos)
+        self.etiquetas = {}
+
+    def vectorizar(self, textos):
+        # Por lotes: el analizador de bigramas nunca ve todo el corpus a la vez
+        return sp.vstack([
+            VECTORIZADOR_CLUSTERS.transform(textos[inicio:inicio + LOTE_CLUSTERS])
+            for inicio in range(0, len(textos), LOTE_CLUSTERS)
+        ]).tocsr()
+
+    def _ajustar(self, X, pases):
+        for _ in range(pases):
+            for inicio in range(0, X.shape[0], LOTE_CLUSTERS):
+                lote = X[inicio:inicio + LOTE_CLUSTERS]
+                # El primer lote inicializa los centroides: necesita n_clusters filas
+                if not self.ajustado and lote.shape[0] < self.n_clusters:
+                    continue
+                self.modelo.partial_fit(lote)
+                self.ajustado = True
+
+    def clasificar(self, textos):
+
+        # Solo los textos nuevos se vectorizan, se incorporan a los centroides
+        # (partial_fit) y se asignan; los demás conservan su cluster
+        claves = [hash(t) for t in textos]
+        nuevos = [k for k, clave in enumerate(claves) if clave not in self.etiquetas]
+
+        if nuevos:
+            if not self.ajustado:
+                if len(nuevos) < self.n_clusters:
+                    return None
+                # Primer ajuste: orden aleatorio y varias pasadas
+                nuevos = list(np.random.default_rng(self.random_state).permutation(nuevos))
+                pases = self.pases
+            else:
+                pases = 1
+
+            X = self.vectorizar([textos[k] for k in nuevos])
+            self._ajustar(X, pases)
+
+            self.etiquetas.update(zip((claves[k] for k in nuevos), self.modelo.predict(X).tolist()))
+
+        # Solo los textos del refresco actual: los editados o borrados salen
+        # del mapa y la memoria queda acotada al Sheet vigente
+        self.etiquetas = {clave: self.etiquetas[clave] for clave in claves}
+
+        return np.array([self.etiquetas[clave] for clave in claves], dtype=np.int64)
+
+
+# Motor del último refresco: centroides y textos vistos se reutilizan
+_motor_clusters = None
+
+
+def obtener_motor_clusters(n_clusters):
+
+    global _motor_clusters
+
+    if _motor_clusters is None or _motor_clusters.n_clusters != n_clusters:
+        _motor_clusters = MotorClusters(n_clusters)
+
+    return _motor_clusters
+
+
 def generar_clusters(df, n_clusters=8):
 
     if "DESCRIPCIÓN DEL TRABAJO" not in df.columns:
@@ -127,38 +398,44 @@ def generar_clusters(df, n_clusters=8):
 
     col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df.columns else "DESCRIPCIÓN DEL TRABAJO"
 
-    textos = df[col_texto].fillna("").astype(str)
+    # Cada texto distinto se vectoriza y asigna una sola vez
+    codigos, textos = pd.factorize(df[col_texto].fillna("").astype(str))
+    textos = list(textos)
 
-    vectorizer = TfidfVectorizer(
-        stop_words=None,
-        ngram_range=(1,2)
-    )
+    etiquetas = obtener_motor_clusters(n_clusters).clasificar(textos)
 
-    X = vectorizer.fit_transform(textos)
+    if etiquetas is None:
+        return df, {}
 
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    df["CLUSTER"] = kmeans.fit_predict(X)
+    df = df.assign(CLUSTER=etiquetas[codigos])
 
-    # 🔥 Crear resumen de clusters
+    # 🔥 Resumen de clusters con un solo groupby
+    resumen = df.groupby("CLUSTER")[col_texto].agg(
+        total="size",
+        ejemplos=lambda textos_cluster: textos_cluster.head(3).tolist()
+    )
 
-    resumen_clusters = {}
+    resumen_clusters = {
+        cluster_id: {
+            "total": int(fila["total"]),
+            "ejemplos": fila["ejemplos"]
+        }
+        for cluster_id, fila in resumen.iterrows()
+    }
 
-    for cluster_id in sorted(df["CLUSTER"].unique()):
-        subset = df[df["CLUSTER"] == cluster_id]
+    return df, resumen_clusters
 
-        col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in subset.columns else "DESCRIPCIÓN DEL TRABAJO"
 
-        ejemplos = subset[col_texto].head(3).tolist()
+def _orden_mes(mes):
 
-        resumen_clusters[cluster_id] = {
-            "total": len(subset),
-            "ejemplos": ejemplos
-        }
+    # Mes como entero (ordinal del Period "M"); NaN donde no hay fecha
+    ordinal = mes.array.asi8.astype("float64")
+    ordinal[mes.isna().to_numpy()] = np.nan
 
-    return df, resumen_clusters
+    return pd.Series(ordinal, index=mes.index)
 
 
-def calcular_riesgo_equipos(df):
+def calcular_riesgo_equipos(df, mes=None):
 
     if df is None or df.empty:
         return {}
@@ -168,108 +445,111 @@ def calcular_riesgo_equipos(df):
     if col_principal is None:
         return {}
 
-    df = df.copy()
+    # Todos los equipos a la vez: una agregación por score, sin filtrar el
+    # DataFrame por equipo (orden de aparición, como el dict original)
+    equipos = df[col_principal]
+    orden = pd.Index(equipos.dropna().unique())
 
-     # 🔹 Fecha
+    def por_equipo(serie):
+        return serie.groupby(equipos, observed=True).sum().reindex(orden, fill_value=0)
 
-    if "FECHA (DÍA 01)" in df.columns:
-        df["FECHA (DÍA 01)"] = pd.to_datetime(
-            df["FECHA (DÍA 01)"], errors="coerce"
-        )
+    total = df.groupby(col_principal, observed=True).size().reindex(orden, fill_value=0)
 
-    riesgo_equipos = {}
+    frecuencia_score = (total * 2).clip(upper=40)
 
-    for eq in df[col_principal].dropna().unique():
+    correctivo_score = pd.Series(0.0, index=orden)
 
-        df_eq = df[df[col_principal] == eq].copy()
-
-        total = len(df_eq)
-
-        frecuencia_score = min(total * 2, 40)
+    if "TIPO DE MANTENIMIENTO" in df.columns:
 
-        correctivo_score = 0
+        tipos = df["TIPO DE MANTENIMIENTO"].astype(str).str.upper()
 
-        if "TIPO DE MANTENIMIENTO" in df_eq.columns:
+        # % de "CORRECTIVO" sobre las filas con tipo (value_counts(normalize=True))
+        correctivo_pct = (
+            por_equipo(tipos == "CORRECTIVO") / por_equipo(tipos.notna())
+        ).fillna(0)
 
-            tipos = (
-                df_eq["TIPO DE MANTENIMIENTO"]
-                .astype(str)
-                .str.upper()
-                .value_counts(normalize=True)
-            )
+        correctivo_score = correctivo_pct * 40
 
-            correctivo_pct = tipos.get("CORRECTIVO", 0)
+    tendencia_score = pd.Series(0, index=orden)
 
-            correctivo_score = correctivo_pct * 40
+    if "FECHA (DÍA 01)" in df.columns:
 
-        tendencia_score = 0
+        orden_mes = _orden_mes(columna_mes(df) if mes is None else mes)
+        max_mes = orden_mes.groupby(equipos, observed=True).transform("max")
 
-        if "FECHA (DÍA 01)" in df_eq.columns:
+        # Últimos 3 meses del equipo vs. todo lo anterior
+        ultimos = por_equipo(orden_mes >= max_mes - 2)
+        anteriores = por_equipo(orden_mes < max_mes - 2)
 
-            df_eq["mes"] = df_eq["FECHA (DÍA 01)"].dt.to_period("M")
+        ratio = ultimos / anteriores.where(anteriores > 0)
 
-            if not df_eq["mes"].isna().all():
+        tendencia_score = pd.Series(
+            np.select([ratio > 2, ratio > 1.3], [20, 10], 0),
+            index=orden
+        )
 
-                max_mes = df_eq["mes"].max()
+    variedad_score = pd.Series(0, index=orden)
 
-                ultimos = df_eq[df_eq["mes"] >= (max_mes - 2)]
-                anteriores = df_eq[df_eq["mes"] < (max_mes - 2)]
+    if "DESCRIPCIÓN DEL TRABAJO" in df.columns:
 
-                if len(anteriores) > 0:
-                    ratio = len(ultimos) / len(anteriores)
+        col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df.columns else "DESCRIPCIÓN DEL TRABAJO"
 
-                    if ratio > 2:
-                        tendencia_score = 20
-                    elif ratio > 1.3:
-                        tendencia_score = 10
+        # Trabajos que se repiten más de una vez en el equipo
+        repeticiones = df.groupby([col_principal, col_texto], observed=True).size()
+        variedad_real = (
+            (repeticiones > 1)
+            .groupby(level=0, observed=True).sum()
+            .reindex(orden, fill_value=0)
+        )
 
-        variedad_score = 0
+        variedad_score = pd.Series(
+            np.select([variedad_real > 10, variedad_real > 5], [10, 5], 0),
+            index=orden
+        )
 
-        if "DESCRIPCIÓN DEL TRABAJO" in df_eq.columns:
+    score = (
+        frecuencia_score +
+        correctivo_score +
+        tendencia_score +
+        variedad_score
+    )
 
-            col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df_eq.columns else "DESCRIPCIÓN DEL TRABAJO"
+    riesgo_equipos = {}
 
-            tipos_trabajo = df_eq[col_texto].value_counts()
-            variedad_real = len(tipos_trabajo[tipos_trabajo > 1])
+    columnas = zip(
+        orden, total.to_numpy(), score.to_numpy(),
+        frecuencia_score.to_numpy(), correctivo_score.to_numpy(),
+        tendencia_score.to_numpy(), variedad_score.to_numpy()
+    )
 
-            if variedad_real > 10:
-                variedad_score = 10
-            elif variedad_real > 5:
-                variedad_score = 5
+    for eq, total_eq, score_eq, frecuencia, correctivo, tendencia, variedad in columnas:
 
-        score = (
-            frecuencia_score +
-            correctivo_score +
-            tendencia_score +
-            variedad_score
-        )
-
-        if score >= 75:
+        if score_eq >= 75:
             nivel = "ALTO"
-        elif score >= 45:
+        elif score_eq >= 45:
             nivel = "MEDIO"
         else:
             nivel = "BAJO"
 
         motivos = []
 
-        if frecuencia_score > 25:
+        if frecuencia > 25:
             motivos.append("Alta frecuencia de intervenciones")
 
-        if correctivo_score > 20:
+        if correctivo > 20:
             motivos.append("Alto porcentaje de mantenimiento correctivo")
 
-        if tendencia_score >= 10:
+        if tendencia >= 10:
             motivos.append("Incremento reciente de eventos")
 
-        if variedad_score > 0:
+        if variedad > 0:
             motivos.append("Alta diversidad de fallas detectadas")
 
         riesgo_equipos[eq] = {
             "riesgo": nivel,
-            "score": round(score, 2),
+            "score": round(float(score_eq), 2),
             "motivo": motivos,
-            "total_eventos": total
+            "total_eventos": int(total_eq)
         }
 
     return riesgo_equipos
@@ -278,27 +558,64 @@ def calcular_riesgo_equipos(df):
 # ==========================================
 # 🔥 INSIGHTS PRINCIPAL
 # ==========================================
-def generar_insights(df):
+def _conteos_por_equipo(equipos, valores, orden):
+
+    # value_counts() de cada equipo con un solo groupby: conteo descendente,
+    # empates en orden de categoría (categóricas) o de aparición (texto)
+    categorica = isinstance(valores.dtype, pd.CategoricalDtype)
+
+    conteos = (
+        valores.groupby([equipos, valores], observed=True, sort=categorica)
+        .size()
+        .sort_values(ascending=False, kind="stable")
+    )
+
+    resultado = {eq: {} for eq in orden}
+
+    for (eq, valor), n in zip(conteos.index, conteos.to_numpy()):
+        resultado[eq][valor] = int(n)
+
+    return resultado
+
+
+def generar_insights(df, tiempos=None):
 
     if df is None or df.empty:
         return {}
 
+    # Tiempo por sub-etapa (segundos)
+    marcar = _marcador({} if tiempos is None else tiempos)
+
     insights = {}
 
     col_principal = obtener_columna_principal(df)
 
     if col_principal:
+        equipos = df[col_principal]
+        orden = pd.Index(equipos.dropna().unique())
+        totales = df.groupby(col_principal, observed=True).size()
+
         equipo_stats = (
-            df.groupby(col_principal)
-            .size()
+            totales
             .sort_values(ascending=False)
             .head(20)
         )
 
         insights["fallas_por_equipo"] = equipo_stats.to_dict()
 
+    marcar("fallas_por_equipo")
+
     df = construir_texto_completo(df)
-   
+    marcar("texto_completo")
+
+    # Centroides del refresco anterior: solo se incorporan textos nuevos
+    df, resumen_clusters = generar_clusters(df)
+
+    if resumen_clusters:
+        insights["resumen_clusters"] = resumen_clusters
+
+    marcar("clusters")
+
     if "CLUSTER" in df.columns:
 
         cluster_stats = (
@@ -311,74 +628,67 @@ def generar_insights(df):
 
     if col_principal and "DESCRIPCIÓN DEL TRABAJO" in df.columns:
 
-        historial = {}
-
-        for eq in df[col_principal].dropna().unique():
-
-            df_eq = df[df[col_principal] == eq]
+        col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df.columns else "DESCRIPCIÓN DEL TRABAJO"
 
-            col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df_eq.columns else "DESCRIPCIÓN DEL TRABAJO"
+        trabajos = _conteos_por_equipo(equipos, df[col_texto], orden)
 
-            historial[eq] = {
-                "total": len(df_eq),
-                "trabajos": df_eq[col_texto].value_counts().to_dict()
+        insights["historial_equipos"] = {
+            eq: {
+                "total": int(totales.get(eq, 0)),
+                "trabajos": trabajos[eq]
             }
+            for eq in orden
+        }
 
-        insights["historial_equipos"] = historial
+    marcar("historial_equipos")
 
-    if "FECHA (DÍA 01)" in df.columns:
+    # Fechas se leen una sola vez: "mes" lo comparten tendencia, riesgo y anomalías
+    mes = None
 
-        df_temp = df.copy()
-        df_temp["FECHA (DÍA 01)"] = pd.to_datetime(df_temp["FECHA (DÍA 01)"], errors="coerce")
+    if "FECHA (DÍA 01)" in df.columns:
 
-        df_temp["mes"] = df_temp["FECHA (DÍA 01)"].dt.to_period("M")
+        mes = columna_mes(df)
 
-        tendencia = df_temp["mes"].value_counts().sort_index()
+        tendencia = mes.value_counts().sort_index()
 
         insights["tendencia"] = tendencia.astype(str).to_dict()
 
+    marcar("tendencia")
+
     if "TIPO DE MANTENIMIENTO" in df.columns:
 
         tipo_dist = df["TIPO DE MANTENIMIENTO"].value_counts()
         insights["tipos_mantenimiento"] = tipo_dist.to_dict()
 
-    if col_principal and "TIPO DE MANTENIMIENTO" in df.columns:
-
-        tipo_por_equipo = {}
-
-        for eq in df[col_principal].dropna().unique():
-
-            df_eq = df[df[col_principal] == eq]
-
-            conteo = df_eq["TIPO DE MANTENIMIENTO"].value_counts()
-
-            tipo_por_equipo[eq] = conteo.to_dict()
-
-        insights["tipo_mantenimiento_por_equipo"] = tipo_por_equipo
-
-    if "FECHA (DÍA 01)" in df.columns and "TIPO DE MANTENIMIENTO" in df.columns:
+    marcar("tipos_mantenimiento")
 
-        df_temp = df.copy()
+    if col_principal and "TIPO DE MANTENIMIENTO" in df.columns:
 
-        df_temp["FECHA (DÍA 01)"] = pd.to_datetime(
-            df_temp["FECHA (DÍA 01)"], errors="coerce"
+        insights["tipo_mantenimiento_por_equipo"] = _conteos_por_equipo(
+            equipos, df["TIPO DE MANTENIMIENTO"], orden
         )
 
-        df_temp["mes"] = df_temp["FECHA (DÍA 01)"].dt.to_period("M")
+    marcar("tipo_mantenimiento_por_equipo")
+
+    if mes is not None and "TIPO DE MANTENIMIENTO" in df.columns:
 
         tendencia_tipo = (
-            df_temp.groupby(["mes", "TIPO DE MANTENIMIENTO"])
+            df.groupby([mes, df["TIPO DE MANTENIMIENTO"]], observed=True)
             .size()
             .unstack(fill_value=0)
         )
 
         insights["tendencia_tipo_mantenimiento"] = tendencia_tipo.astype(str).to_dict()
 
-    riesgo = calcular_riesgo_equipos(df.copy())
+    marcar("tendencia_tipo_mantenimiento")
+
+    riesgo = calcular_riesgo_equipos(df, mes)
     insights["riesgo_equipos"] = riesgo
+    marcar("riesgo_equipos")
 
-    anomalias = detectar_anomalias(df)
+    anomalias = detectar_anomalias(df, mes)
     insights["anomalias"] = anomalias
+    marcar("anomalias")
 
     return insights
 
@@ -386,13 +696,62 @@ def generar_insights(df):
 # ==========================================
 # GUARDAR EN MEMORIA
 # ==========================================
-def guardar_insights(df):
-    global INSIGHTS
-    INSIGHTS = generar_insights(df)
+def guardar_insights(df, version=None):
+
+    # Corre en segundo plano después de cada refresco del Sheet
+    global ESTADO_INSIGHTS, _version_pedida
+
+    _version_pedida = version
+
+    with _lock_insights:
+
+        # Ya publicada, o superada por otra pedida mientras esperaba el lock
+        if version is not None and version == ESTADO_INSIGHTS["version"]:
+            return
+        if version != _version_pedida:
+            return
+
+        inicio = time.perf_counter()
+        tiempos = {}
+
+        try:
+            insights = generar_insights(df, tiempos)
+        except Exception as e:
+            print(f"Error al generar insights: {e}")
+            return
+
+        # Mientras se calculaba llegó una versión más nueva: esta ya no vale
+        if version != _version_pedida:
+            print(f"⏭️ Insights {version} descartados (hay una versión más nueva)")
+            return
+
+        # 🔁 Publicación atómica
+        ESTADO_INSIGHTS = {
+            "insights": insights,
+            "version": version,
+            "generado": time.time(),
+            "tiempos": tiempos,
+        }
+
+        total = time.perf_counter() - inicio
+        detalle = " | ".join(f"{etapa}: {t:.2f}s" for etapa, t in tiempos.items())
+        print(f"📈 Insights {version} publicados en {total:.2f}s ({detalle})")
+
+
+def guardar_insights_en_segundo_plano(df, version=None):
+    # No daemon: un hilo daemon que sigue dentro de sklearn/pyarrow cuando el
+    # intérprete se cierra aborta el proceso; el cierre espera al cálculo en curso.
+    # Explícito: sin daemon= se hereda del hilo que lo crea (el refresco)
+    hilo = threading.Thread(target=guardar_insights, args=(df, version), daemon=False)
+    hilo.start()
+    return hilo
 
 
 # ==========================================
 # OBTENER
 # ==========================================
 def obtener_insights():
-    return INSIGHTS
\ No newline at end of file
+    return ESTADO_INSIGHTS["insights"]
+
+def obtener_estado_insights():
+    return ESTADO_INSIGHTS
\ No newline at end of file
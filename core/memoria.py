@@ -0,0 +1,117 @@
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    TIPO_TEXTO = pd.StringDtype("pyarrow")
+except ImportError:
+    TIPO_TEXTO = None
+
+
+# ==========================================
+# COLUMNAS QUE NUNCA SE ELIMINAN / CATEGORIZAN
+# ==========================================
+
+# Referenciadas por nombre en main, insights y analytics: aunque vengan
+# vacías tienen que existir
+COLUMNAS_PROTEGIDAS = [
+    "CODIGO_EXTRAIDO",
+    "DESCRIPCION_EXTRAIDA",
+    "DESCRIPCIÓN DEL TRABAJO",
+    "FECHA (DÍA 01)",
+    "TIPO DE MANTENIMIENTO",
+    "DIA 1) TEC. N° 01",
+    "TEXTO_RAG",
+    "TEXTO_RAG_NORM",
+    "CODIGO_NORM",
+    "DESC_NORM",
+]
+
+# Texto libre: se usa con value_counts/índices, se guarda como string
+# (pyarrow) y no como categoría
+COLUMNAS_TEXTO_LIBRE = [
+    "DESCRIPCIÓN DEL TRABAJO",
+    "TEXTO_RAG",
+    "TEXTO_RAG_NORM",
+    "TEXTO_COMPLETO",
+]
+
+# Por debajo de esta proporción de valores distintos conviene categoría
+UMBRAL_CATEGORIA = 0.5
+
+
+# ==========================================
+# COMPACTACIÓN DEL DATAFRAME EN CACHE
+# ==========================================
+
+def _es_texto(serie):
+    return (
+        pd.api.types.is_object_dtype(serie) or
+        pd.api.types.is_string_dtype(serie)
+    ) and not isinstance(serie.dtype, pd.CategoricalDtype)
+
+
+def _esta_vacia(serie):
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.categories.isin([""]).all() or serie.isna().all()
+    if _es_texto(serie):
+        return bool(serie.isna().all() or (serie.fillna("").astype(str).str.strip() == "").all())
+    return bool(serie.isna().all())
+
+
+def compactar_dataframe(df):
+
+    if df is None or df.empty:
+        return df
+
+    vacias = [
+        c for c in df.columns
+        if c not in COLUMNAS_PROTEGIDAS and _esta_vacia(df[c])
+    ]
+
+    # Sin copia profunda: se reasignan columnas sobre un frame nuevo
+    df = df.drop(columns=vacias)
+
+    for col in df.columns:
+        serie = df[col]
+
+        # Ya categórica (filas reusadas del snapshot anterior): sin las
+        # categorías de filas que se borraron del Sheet
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            df[col] = serie.cat.remove_unused_categories()
+            continue
+
+        if not _es_texto(serie) or serie.isna().any():
+            continue
+
+        if col not in COLUMNAS_TEXTO_LIBRE and serie.nunique() <= len(serie) * UMBRAL_CATEGORIA:
+            df[col] = serie.astype("category")
+        elif TIPO_TEXTO is not None and serie.dtype != TIPO_TEXTO:
+            df[col] = serie.astype(TIPO_TEXTO)
+
+    return df
+
+
+def reporte_memoria(df_antes, df_despues):
+
+    antes = df_antes.memory_usage(deep=True, index=False)
+    despues = df_despues.memory_usage(deep=True, index=False)
+
+    reporte = pd.DataFrame({
+        "antes": antes,
+        "despues": despues.reindex(antes.index).fillna(0).astype("int64"),
+        "tipo": df_despues.dtypes.astype(str).reindex(antes.index).fillna("eliminada"),
+    })
+    reporte["ahorro"] = reporte["antes"] - reporte["despues"]
+
+    return reporte.sort_values("ahorro", ascending=False)
+
+
+def imprimir_reporte_memoria(reporte, top=10):
+
+    total_antes = reporte["antes"].sum() / 1024 / 1024
+    total_despues = reporte["despues"].sum() / 1024 / 1024
+
+    print(f"🧮 Memoria DataFrame: {total_antes:.2f} MB → {total_despues:.2f} MB")
+
+    for col, fila in reporte.head(top).iterrows():
+        print(f"   - {col}: {fila['antes']} → {fila['despues']} bytes ({fila['tipo']})")
@@ -0,0 +1,87 @@
+import os
+import pickle
+import time
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+# ==========================================
+# SNAPSHOT LOCAL DEL CACHE
+# ==========================================
+# DataFrame procesado → Feather sin compresión (Arrow IPC, se abre con mmap
+# y varios workers comparten las mismas páginas del sistema operativo).
+# Índices y metadatos del refresco → pickle aparte.
+
+DIRECTORIO_SNAPSHOT = os.getenv(
+    "RAG_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+)
+
+ARCHIVO_DF = "cache_excel.feather"
+ARCHIVO_META = "cache_excel.pkl"
+
+
+def _ruta(nombre):
+    return os.path.join(DIRECTORIO_SNAPSHOT, nombre)
+
+
+def _escribir_atomico(nombre, escribir):
+    # Se escribe a un temporal y se renombra: un worker que lee nunca ve
+    # un archivo a medio escribir
+    os.makedirs(DIRECTORIO_SNAPSHOT, exist_ok=True)
+    temporal = _ruta(f".{nombre}.{os.getpid()}.tmp")
+    escribir(temporal)
+    os.replace(temporal, _ruta(nombre))
+
+
+def guardar_snapshot(snapshot):
+
+    inicio = time.time()
+
+    meta = {k: v for k, v in snapshot.items() if k != "df"}
+
+    # El hash del contenido viaja también en el esquema Arrow: al cargar se
+    # comprueba que el Feather y el pickle son del mismo refresco
+    tabla = pa.Table.from_pandas(snapshot["df"], preserve_index=False)
+    tabla = tabla.replace_schema_metadata(dict(
+        tabla.schema.metadata or {},
+        hash_contenido=str(meta.get("hash_contenido"))
+    ))
+
+    _escribir_atomico(
+        ARCHIVO_DF,
+        lambda ruta: feather.write_feather(tabla, ruta, compression="uncompressed")
+    )
+
+    def escribir_meta(ruta):
+        with open(ruta, "wb") as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    _escribir_atomico(ARCHIVO_META, escribir_meta)
+
+    print(f"💽 Snapshot local guardado en {time.time() - inicio:.2f}s")
+
+
+def cargar_snapshot():
+
+    if not (os.path.exists(_ruta(ARCHIVO_DF)) and os.path.exists(_ruta(ARCHIVO_META))):
+        return None
+
+    inicio = time.time()
+
+    with open(_ruta(ARCHIVO_META), "rb") as f:
+        meta = pickle.load(f)
+
+    tabla = feather.read_table(_ruta(ARCHIVO_DF), memory_map=True)
+
+    hash_df = (tabla.schema.metadata or {}).get(b"hash_contenido", b"").decode()
+    if hash_df != str(meta.get("hash_contenido")):
+        print("⚠️ Snapshot local inconsistente, se ignora")
+        return None
+
+    snapshot = dict(meta, df=tabla.to_pandas())
+
+    print(f"💽 Snapshot local cargado en {(time.time() - inicio) * 1000:.0f} ms")
+
+    return snapshot
@@ -1,29 +1,27 @@
 import pandas as pd
+import numpy as np
 import requests
 import io
 import time
-import re
+import threading
+import hashlib
 
 
-from core.insights import guardar_insights
+from core.insights import guardar_insights_en_segundo_plano, obtener_estado_insights
+from core.texto import normalizar, normalizar_serie, ConcatenadorColumnas
+from core.memoria import compactar_dataframe, reporte_memoria, imprimir_reporte_memoria
+from core.persistencia import guardar_snapshot, cargar_snapshot
+from core.indices import construir_indice_equipos, construir_indice_busqueda, rankear_bm25
+from core.indices import construir_particiones_equipo, construir_indice_analisis
+from core.serializador import SerializadorFilas
+from core.cubos import construir_cubos, enlazar_cubos
+from core.insights import obtener_columna_principal, construir_texto_completo
 
 # ==========================================
 # NORMALIZADOR
 # ==========================================
 
-def normalizar(texto):
-    import unicodedata, re
-    if not texto:
-        return ""
-    texto = str(texto).lower()
-    texto = "".join(
-        c for c in unicodedata.normalize('NFD', texto)
-        if unicodedata.category(c) != 'Mn'
-    )
-    texto = re.sub(r'[^a-z0-9\s]', '', texto)
-    return texto.strip()
-
-def construir_texto_rag(df):
+def construir_texto_rag(df, concatenador=None):
 
     columnas_base = [
         "DESCRIPCIÓN DEL TRABAJO",
@@ -39,14 +37,10 @@ def construir_texto_rag(df):
 
     columnas_usar = [c for c in columnas_usar if c in df.columns]
 
-    df = df.copy()
+    concatenador = concatenador or ConcatenadorColumnas(df)
 
-    df["TEXTO_RAG"] = (
-        df[columnas_usar]
-        .fillna("")
-        .astype(str)
-        .agg(" | ".join, axis=1)
-    )
+    df["TEXTO_RAG"] = concatenador.concatenar(columnas_usar, " | ")
+    df["TEXTO_RAG_NORM"] = concatenador.concatenar_normalizado(columnas_usar, " | ")
 
     return df
 
@@ -56,138 +50,455 @@ def construir_texto_rag(df):
 # CACHE
 # ==========================================
 
+# El snapshot completo se reemplaza de una sola vez (nunca se muta por partes):
+# las peticiones siempre leen una versión consistente de df + índices.
 cache_excel = {
     "df": None,
-    "last_update": 0
+    "last_update": 0,
+    "indice_equipos": None,
+    "indice_busqueda": None,
+    "indice_analisis": None,
+    "cubos": {},
+    "particiones_equipo": {},
+    "serializador": None
 }
 
 GOOGLE_SHEET_CSV_URL = "https://docs.google.com/spreadsheets/d/12z2M2H_iE6MAKjgPbDwmt2HaJ7ZQRfx_PL0jDxbQnS8/export?format=csv&gid=955581654"
 
+TTL_CACHE = 3600
+REINTENTO_TRAS_ERROR = 60
+
+# Sube cuando cambian las columnas que genera procesar_filas: las filas de
+# un snapshot procesado con otra versión no se reutilizan
+VERSION_PROCESADO = 3
+
+# Sube cuando cambia el formato de los objetos que viajan en el pickle del
+# snapshot local (cubos, serializador, índices): uno viejo se ignora
+VERSION_SNAPSHOT = 2
+
+# Refresco single-flight: solo un hilo descarga/reconstruye a la vez
+_lock_refresco = threading.Lock()
+_lock_indice_analisis = threading.Lock()
+_ultimo_intento_fallido = 0
+
 # ==========================================
 # CARGA DE DATA
 # ==========================================
 
-def cargar_datos():
+def descargar_sheet(anterior):
+
+    # 🔁 GET condicional: si Google devuelve el mismo ETag no hay nada que bajar
+    headers = {}
+    if anterior.get("etag"):
+        headers["If-None-Match"] = anterior["etag"]
+
+    res = requests.get(GOOGLE_SHEET_CSV_URL, timeout=5, headers=headers)
+
+    if res.status_code == 304:
+        return None, anterior.get("etag")
+
+    res.raise_for_status()
+
+    return res.content, res.headers.get("ETag")
+
+
+def leer_csv(contenido):
+
+    df = pd.read_csv(
+     io.BytesIO(contenido),
+     encoding="utf-8",
+     sep=None,
+     engine="python"
+     ).fillna("")
+
+    print("✅ CSV convertido a DataFrame")
+    print("📊 Filas:", len(df))
+    print("📊 Columnas INICIALES:", len(df.columns))
+
+    # ==========================================================
+    # 🔥 CAMBIO CLAVE: YA NO SE RECORTAN NI LIMITAN LAS COLUMNAS
+    # ==========================================================
+    # Comentamos el recorte rígido anterior para asegurar que columnas 
+    # de ubicación lejana (como la 163) sigan existiendo en el DataFrame.
+    #
+    # columnas_necesarias = [...]
+    # columnas_tareas = [...]
+    # columnas_resp = [...]
+    # columnas_finales = columnas_necesarias + columnas_tareas + columnas_resp
+    # df = df[[c for c in columnas_finales if c in df.columns]]
+
+    # Limpiamos los nombres de las columnas para evitar espacios en blanco invisibles
+    df.columns = [str(c).strip() for c in df.columns]
+
+    print("📊 Columnas CONSERVADAS (Total real):", len(df.columns))
+
+    return df
+
+
+# ==========================================
+# LIMPIEZA DE ".0" POR TIPO DE COLUMNA
+# ==========================================
+
+def _float_a_texto(serie):
+
+    valores = serie.to_numpy(dtype="float64")
+    presentes = ~np.isnan(valores)
+
+    # Enteros representables sin notación científica (str(1e16) == "1e+16")
+    enteros = (
+        (np.mod(valores, 1) == 0) &
+        (np.abs(valores) < 1e16) &
+        ~((valores == 0) & np.signbit(valores))
+    )
+
+    if enteros[presentes].all():
+        # Columna entera: un solo cast a Int64 → texto
+        texto = serie.astype("Int64").astype(str)
+    else:
+        texto = serie.astype(str).str.replace(r'\.0$', '', regex=True)
+
+    return texto.where(presentes, serie)
+
+
+def _quitar_sufijo_decimal(serie):
+
+    presentes = serie.notna()
+
+    if presentes.all():
+        return serie.astype(str).str.replace(r'\.0$', '', regex=True)
+
+    texto = serie[presentes].astype(str).str.replace(r'\.0$', '', regex=True)
+    return texto.reindex(serie.index).where(presentes, serie)
+
+
+def limpiar_decimales(df):
+
+    for col in df.columns:
+        serie = df[col]
+
+        if pd.api.types.is_float_dtype(serie):
+            df[col] = _float_a_texto(serie)
+
+        elif pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie):
+            # Texto (con floats sueltos mezclados): un único str.replace vectorizado
+            df[col] = _quitar_sufijo_decimal(serie)
+
+    return df
+
+
+def procesar_filas(df):
+
+    # Todo lo que se hace aquí depende solo de cada fila: por eso se puede
+    # aplicar únicamente a las filas nuevas o editadas en un refresco.
+
+    # Formatear fecha
+    col_fecha = "FECHA (DÍA 01)"
+    if col_fecha in df.columns:
+      df[col_fecha] = pd.to_datetime(df[col_fecha], errors='coerce', dayfirst=True)
+
+    # Quita el ".0" que deja pandas en números leídos como float, columna por columna
+    limpiar_decimales(df)
+
+    # 🔽 AQUÍ: TEXTO_RAG
+    print("🧠 Construyendo TEXTO_RAG...")
+
+    # 🔥 NUEVO: construir texto RAG (TEXTO_RAG + TEXTO_RAG_NORM) y TEXTO_COMPLETO
+    # de los insights en una pasada: cada columna se convierte a texto una vez
+    concatenador = ConcatenadorColumnas(df)
+    df = construir_texto_rag(df, concatenador)
+    df = construir_texto_completo(df, concatenador)
+
+    print("✅ TEXTO_RAG listo")
+    print("⚙️ Normalizando columnas...")
+
+
+   # 🔥 NORMALIZACIONES QUE CONSERVAN ESTRUCTURAS DE CÓDIGOS (Guiones y barras)
+    # Aseguramos de enviar un String limpio a la función de normalización
+    if "CODIGO_EXTRAIDO" in df.columns:
+        df["CODIGO_NORM"] = normalizar_serie(df["CODIGO_EXTRAIDO"].fillna("").astype(str))
+    else:
+        df["CODIGO_NORM"] = ""
+
+    if "DESCRIPCION_EXTRAIDA" in df.columns:
+        df["DESC_NORM"] = normalizar_serie(df["DESCRIPCION_EXTRAIDA"].fillna("").astype(str))
+    else:
+        df["DESC_NORM"] = ""
+
+    return df
+
+
+def huellas_filas(df):
+    # Huella de 64 bits por fila sobre los valores crudos del CSV
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def procesar_incremental(df_crudo, huellas, anterior):
+
+    df_previo = anterior.get("df")
+
+    # Sin snapshot previo, con columnas distintas o procesado con otra versión
+    # de procesar_filas: reconstrucción completa
+    if (
+        df_previo is None or
+        anterior.get("columnas") != list(df_crudo.columns) or
+        anterior.get("version_procesado") != VERSION_PROCESADO
+    ):
+        return procesar_filas(df_crudo)
+
+    posicion_previa = {h: pos for pos, h in enumerate(anterior["huellas"])}
+    origen = [posicion_previa.get(h, -1) for h in huellas]
+
+    reusadas = [i for i, pos in enumerate(origen) if pos >= 0]
+    nuevas = [i for i, pos in enumerate(origen) if pos < 0]
+
+    print(f"♻️ Filas reutilizadas: {len(reusadas)} | nuevas/editadas: {len(nuevas)}")
+
+    if not nuevas:
+        df = df_previo.iloc[[origen[i] for i in reusadas]]
+        return df.reset_index(drop=True)
+
+    # TEXTO_COMPLETO solo sirve entero (para los insights): con filas
+    # reutilizadas quedaría a medias y los insights lo arman por su cuenta
+    df_nuevo = procesar_filas(df_crudo.iloc[nuevas].copy()).drop(columns=["TEXTO_COMPLETO"], errors="ignore")
+    df_nuevo.index = nuevas
+
+    partes = []
+
+    if reusadas:
+        # Las columnas que el snapshot compacto eliminó por vacías vuelven como ""
+        df_reusado = df_previo.iloc[[origen[i] for i in reusadas]].reindex(
+            columns=df_nuevo.columns, fill_value=""
+        )
+        df_reusado.index = reusadas
+        partes.append(df_reusado)
+
+    partes.append(df_nuevo)
+
+    df = pd.concat(partes).sort_index()
+    return df.reset_index(drop=True)
+
+
+def construir_cache(anterior=None):
+
+    anterior = anterior or {}
+
+    print("🚀 INICIO carga de datos")
+    # 🔽 AQUÍ: antes de descargar
+    print("📥 Descargando CSV...")
+
+    contenido, etag = descargar_sheet(anterior)
+
+    # 🔹 304 Not Modified o contenido idéntico: se conserva el snapshot
+    if contenido is None:
+        print("✅ Sheet sin cambios (ETag)")
+        return dict(anterior, last_update=time.time())
+
+    hash_contenido = hashlib.sha256(contenido).hexdigest()
+
+    if anterior.get("df") is not None and hash_contenido == anterior.get("hash_contenido"):
+        print("✅ Sheet sin cambios (hash)")
+        return dict(anterior, last_update=time.time(), etag=etag)
+
+    print("✅ CSV descargado")
+    # 🔽 AQUÍ: después de leer CSV
+    print("📊 Leyendo CSV en DataFrame...")
+
+    df_crudo = leer_csv(contenido)
+    columnas = list(df_crudo.columns)
+    huellas = huellas_filas(df_crudo)
+
+    df_procesado = procesar_incremental(df_crudo, huellas, anterior)
+
+    # TEXTO_COMPLETO se arma en la misma pasada que TEXTO_RAG pero no queda
+    # en el DataFrame en cache: se entrega a los insights y nada más
+    texto_completo = None
+    if "TEXTO_COMPLETO" in df_procesado.columns:
+        texto_completo = df_procesado.pop("TEXTO_COMPLETO")
+
+    # 🧮 Layout compacto: categorías, strings pyarrow y sin columnas vacías
+    df = compactar_dataframe(df_procesado)
+    reporte = reporte_memoria(df_procesado, df)
+    imprimir_reporte_memoria(reporte)
+
+    # Versión de los datos: viaja en df.attrs (y en los slices que salen de él)
+    version = hash_contenido[:12]
+    df.attrs["version"] = version
+
+    indice_busqueda = construir_indice_busqueda(df)
+
+    return {
+        "df": df,
+        "last_update": time.time(),
+        "etag": etag,
+        "hash_contenido": hash_contenido,
+        "version": version,
+        "columnas": columnas,
+        "huellas": huellas,
+        "version_procesado": VERSION_PROCESADO,
+        "version_snapshot": VERSION_SNAPSHOT,
+        "reporte_memoria": reporte,
+        "texto_completo": texto_completo,
+        # 🔥 Índice de equipos (código / descripción) para detección en O(largo del texto)
+        "indice_equipos": construir_indice_equipos(df),
+        # 🔥 Índices de búsqueda (código, descripción y texto RAG)
+        "indice_busqueda": indice_busqueda,
+        # 🔎 OT → equipo y textos normalizados para el motor analítico: se
+        # arma en la primera consulta analítica (obtener_indice_analisis)
+        "indice_analisis": None,
+        # 🧊 Conteos equipo × mes × tipo × técnico para el motor analítico
+        "cubos": construir_cubos(df, indice_busqueda.get("texto")),
+        # 🗂️ Filas por equipo + serializador disperso de filas para el contexto
+        "particiones_equipo": construir_particiones_equipo(df, obtener_columna_principal(df)),
+        "serializador": SerializadorFilas(df, version)
+    }
+
+
+def restaurar_snapshot_local():
 
     global cache_excel
 
-    if cache_excel["df"] is None or (time.time() - cache_excel["last_update"] > 3600):
-        
-        try:
-            print("🚀 INICIO carga de datos")
-            # 🔽 AQUÍ: antes de descargar
-            print("📥 Descargando CSV...")
-
-
-            res = requests.get(GOOGLE_SHEET_CSV_URL, timeout=5)
-            res.raise_for_status()      
-
-            print("✅ CSV descargado")
-            # 🔽 AQUÍ: después de leer CSV
-            print("📊 Leyendo CSV en DataFrame...")
-
-            df = pd.read_csv(
-             io.BytesIO(res.content),
-             encoding="utf-8",
-             sep=None,
-             engine="python"
-             ).fillna("")
-            
-            print("✅ CSV convertido a DataFrame")
-            print("📊 Filas:", len(df))
-            print("📊 Columnas INICIALES:", len(df.columns))
-            
-            # ==========================================================
-            # 🔥 CAMBIO CLAVE: YA NO SE RECORTAN NI LIMITAN LAS COLUMNAS
-            # ==========================================================
-            # Comentamos el recorte rígido anterior para asegurar que columnas 
-            # de ubicación lejana (como la 163) sigan existiendo en el DataFrame.
-            #
-            # columnas_necesarias = [...]
-            # columnas_tareas = [...]
-            # columnas_resp = [...]
-            # columnas_finales = columnas_necesarias + columnas_tareas + columnas_resp
-            # df = df[[c for c in columnas_finales if c in df.columns]]
-            
-            # Limpiamos los nombres de las columnas para evitar espacios en blanco invisibles
-            df.columns = [str(c).strip() for c in df.columns]
-
-            print("📊 Columnas CONSERVADAS (Total real):", len(df.columns))
-
-            # Formatear fecha
-            col_fecha = "FECHA (DÍA 01)"
-            if col_fecha in df.columns:
-              df[col_fecha] = pd.to_datetime(df[col_fecha], errors='coerce', dayfirst=True)
-
-            for col in df.columns:
-                if df[col].dtype == 'object' or df[col].dtype == 'float64':
-                    # Reemplaza temporalmente el patrón ".0" al final del texto sin corromper nulos reales
-                    df[col] = df[col].apply(lambda x: re.sub(r'\.0$', '', str(x)) if pd.notna(x) else x)
-
-            # 🔽 AQUÍ: TEXTO_RAG
-            print("🧠 Construyendo TEXTO_RAG...")
-
-            # 🔥 NUEVO: construir texto RAG
-            df = construir_texto_rag(df)
-
-            print("✅ TEXTO_RAG listo")
-            print("⚙️ Normalizando columnas...")
-
-
-           # 🔥 NORMALIZACIONES QUE CONSERVAN ESTRUCTURAS DE CÓDIGOS (Guiones y barras)
-            # Aseguramos de enviar un String limpio a la función de normalización
-            df["TEXTO_RAG_NORM"] = df["TEXTO_RAG"].fillna("").apply(normalizar)
-            
-            if "CODIGO_EXTRAIDO" in df.columns:
-                df["CODIGO_NORM"] = df["CODIGO_EXTRAIDO"].fillna("").astype(str).apply(normalizar)
-            else:
-                df["CODIGO_NORM"] = ""
-                
-            if "DESCRIPCION_EXTRAIDA" in df.columns:
-                df["DESC_NORM"] = df["DESCRIPCION_EXTRAIDA"].fillna("").astype(str).apply(normalizar)
-            else:
-                df["DESC_NORM"] = ""
-
-            cache_excel["df"] = df
-            cache_excel["last_update"] = time.time()
-
-            print("💾 DataFrame guardado en cache")
-
-            # ❌ IMPORTANTE: DEJAR COMENTADO
-            # guardar_insights(df)
-
-            print("🏁 FIN carga de datos")
-            
-        except Exception as e:
-            print(f"Error al descargar datos del Sheet: {e}")
-            print("📥 CSV descargado")
-            return None        
-    return cache_excel["df"]
+    try:
+        local = cargar_snapshot()
+    except Exception as e:
+        print(f"No se pudo leer el snapshot local: {e}")
+        return False
+
+    # Snapshot de una versión anterior del código (le faltan claves): se ignora
+    if local is None or local.get("df") is None or not set(cache_excel) <= set(local):
+        return False
+
+    if local.get("version_snapshot") != VERSION_SNAPSHOT:
+        print("⚠️ Snapshot local con formato anterior, se ignora")
+        return False
+
+    local["df"].attrs["version"] = local.get("version")
+    local["serializador"].enlazar(local["df"])
+    enlazar_cubos(local["cubos"], local["df"])
+
+    cache_excel = local
+    return True
+
+
+def programar_insights(snapshot, texto_completo=None):
+
+    # Solo si los insights publicados son de otra versión de los datos
+    if snapshot["df"] is None or snapshot.get("version") == obtener_estado_insights()["version"]:
+        return
+
+    df = snapshot["df"]
+
+    # Sin TEXTO_COMPLETO de la carga (refresco incremental o snapshot local)
+    # los insights lo construyen en su hilo
+    if texto_completo is not None:
+        df = df.assign(TEXTO_COMPLETO=texto_completo.to_numpy())
+
+    guardar_insights_en_segundo_plano(df, snapshot.get("version"))
+
+
+def refrescar_cache():
+
+    # Se llama con _lock_refresco tomado; lo libera al terminar
+    global cache_excel, _ultimo_intento_fallido
+
+    try:
+        anterior = cache_excel
+        nuevo = construir_cache(anterior)
+
+        # Solo para los insights: no se publica ni se persiste
+        texto_completo = nuevo.pop("texto_completo", None)
+
+        # 🔁 Swap atómico del snapshot
+        cache_excel = nuevo
+
+        print("💾 DataFrame guardado en cache")
+
+        # 💽 Persistir solo si los datos cambiaron
+        if nuevo["df"] is not anterior["df"]:
+            try:
+                guardar_snapshot(nuevo)
+            except Exception as e:
+                print(f"No se pudo guardar el snapshot local: {e}")
+
+        # 📈 Insights fuera de la petición: se recalculan en segundo plano
+        programar_insights(nuevo, texto_completo)
+
+        print("🏁 FIN carga de datos")
+
+    except Exception as e:
+        _ultimo_intento_fallido = time.time()
+        print(f"Error al descargar datos del Sheet: {e}")
+
+    finally:
+        _lock_refresco.release()
+
+
+def cargar_datos():
+
+    snapshot = cache_excel
+
+    # 🔹 Primer arranque: snapshot local si existe (y se revalida contra el
+    # Sheet en segundo plano); si no, carga en línea
+    if snapshot["df"] is None:
+
+        _lock_refresco.acquire()
+
+        if cache_excel["df"] is not None:
+            # Otro hilo terminó la carga mientras esperábamos
+            _lock_refresco.release()
+        elif restaurar_snapshot_local():
+            programar_insights(cache_excel)
+            # No daemon (igual que los insights): el refresco escribe Feather y
+            # ajusta CountVectorizer; cortarlo al cerrar el intérprete aborta
+            threading.Thread(target=refrescar_cache, daemon=False).start()
+        else:
+            refrescar_cache()
+
+        return cache_excel["df"]
+
+    # 🔹 Stale-while-revalidate: se sirve el último snapshot bueno y se
+    # refresca en segundo plano (solo si nadie más lo está haciendo)
+    vencido = time.time() - snapshot["last_update"] > TTL_CACHE
+    en_espera = time.time() - _ultimo_intento_fallido < REINTENTO_TRAS_ERROR
+
+    if vencido and not en_espera and _lock_refresco.acquire(blocking=False):
+        threading.Thread(target=refrescar_cache, daemon=False).start()
+
+    return snapshot["df"]
 
 # ==========================================
-# BÚSQUEDA SIMPLE (SIN TOP)
+# BÚSQUEDA SIMPLE (SIN TOP) / RANKEADA (BM25)
 # ==========================================
 
-def buscar_en_sheet(query):
+def buscar_en_sheet(query, modo="simple", k=5):
+
+    cargar_datos()
 
-    df = cargar_datos()
+    snapshot = cache_excel
+    df = snapshot["df"]
 
     if df is None or not query:
         return None
 
+    indice = snapshot["indice_busqueda"]
     q = normalizar(query)
 
     # 🔥 1. Búsqueda por código (rápida)
-    mask_codigo = df["CODIGO_NORM"].str.contains(q, na=False)
+    filas = indice["codigo"].buscar(q, limite=5)
 
-    if mask_codigo.any():
-        return df[mask_codigo].head(5)
+    if len(filas):
+        return df.iloc[filas[:5]]
 
     # 🔥 2. Búsqueda por descripción de equipo
-    mask_desc = df["DESC_NORM"].str.contains(q, na=False)
+    filas = indice["desc"].buscar(q, limite=5)
 
-    if mask_desc.any():
-        return df[mask_desc].head(5)
+    if len(filas):
+        return df.iloc[filas[:5]]
+
+    # 🏆 Modo rankeado: el texto libre (sin código ni descripción que
+    # coincida) va por score BM25 sobre TEXTO_RAG_NORM, top-k filas
+    if modo == "bm25":
+        filas = rankear_bm25(indice.get("bm25"), q, k)
+        return df.iloc[filas] if len(filas) else None
 
     # 🔥 3. Búsqueda en texto consolidado
     palabras = [p for p in q.split() if len(p) > 3]
@@ -195,17 +506,13 @@ def buscar_en_sheet(query):
     if not palabras:
         return None
 
-    mask_total = False
-
-    for p in palabras:
-        mask_total = mask_total | df["TEXTO_RAG_NORM"].str.contains(p, na=False)
-
-    resultado = df[mask_total]
+    # Unión de las posting lists de cada palabra
+    filas = np.unique(np.concatenate([indice["texto"].buscar(p, limite=5) for p in palabras]))
 
-    if resultado.empty:
+    if not len(filas):
         return None
 
-    return resultado.head(5)
+    return df.iloc[filas[:5]]
 
 # ==========================================
 # ACCESO GLOBAL
@@ -214,10 +521,78 @@ def buscar_en_sheet(query):
 def obtener_dataframe():
     return cargar_datos()
 
-def formatear_contexto(df_resultado):
+def obtener_snapshot():
+    # Una petición que lee df + índices toma el snapshot una sola vez: si se
+    # publica otro a mitad de camino, sigue con estructuras coherentes entre sí
+    cargar_datos()
+    return cache_excel
+
+def obtener_indice_equipos(df=None):
+
+    snapshot = cache_excel
+
+    if df is None or df is snapshot["df"]:
+        return snapshot["indice_equipos"]
+
+    # DataFrame externo al cache: se indexa al vuelo
+    return construir_indice_equipos(df)
+
+def obtener_indice_analisis(df=None):
+
+    snapshot = cache_excel
+
+    if df is None or df is snapshot["df"]:
+        # Solo lo usa el motor analítico: no se paga en cada refresco ni
+        # viaja en el snapshot local, se arma una vez por versión de datos
+        if snapshot["indice_analisis"] is None:
+            with _lock_indice_analisis:
+                if snapshot["indice_analisis"] is None:
+                    df = snapshot["df"]
+                    snapshot["indice_analisis"] = construir_indice_analisis(df, obtener_columna_principal(df))
+        return snapshot["indice_analisis"]
+
+    return construir_indice_analisis(df, obtener_columna_principal(df))
+
+def obtener_cubos(df=None):
+
+    snapshot = cache_excel
+
+    if df is None or df is snapshot["df"]:
+        return snapshot["cubos"]
+
+    return construir_cubos(df)
+
+def particion_en_snapshot(snapshot, equipo):
+    return snapshot["particiones_equipo"].get(str(equipo), np.array([], dtype=np.int64))
+
+def obtener_particion_equipo(df, equipo):
+
+    snapshot = cache_excel
+
+    if df is snapshot["df"]:
+        return particion_en_snapshot(snapshot, equipo)
+
+    particiones = construir_particiones_equipo(df, obtener_columna_principal(df))
+    return particiones.get(str(equipo), np.array([], dtype=np.int64))
+
+def obtener_serializador(df=None):
+
+    snapshot = cache_excel
+
+    if df is None or df is snapshot["df"]:
+        return snapshot["serializador"]
+
+    return SerializadorFilas(df)
+
+def formatear_bloques(df_resultado):
 
     if df_resultado is None or df_resultado.empty:
-        return "No se encontró información para ese equipo."
+        return []
+
+    # Filas del DataFrame en cache: bloques ya serializados (índice = posición)
+    serializador = cache_excel["serializador"]
+    if serializador is not None and df_resultado.attrs.get("version") == serializador.version:
+        return [serializador.bloque(pos) for pos in df_resultado.index]
 
     respuesta = []
 
@@ -231,4 +606,11 @@ def formatear_contexto(df_resultado):
 """
         respuesta.append(bloque)
 
-    return "\n\n".join(respuesta)
\ No newline at end of file
+    return respuesta
+
+def formatear_contexto(df_resultado):
+
+    if df_resultado is None or df_resultado.empty:
+        return "No se encontró información para ese equipo."
+
+    return "\n\n".join(formatear_bloques(df_resultado))
@@ -0,0 +1,78 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from core.texto import normalizar
+
+
+# ==========================================
+# CACHE DE RESPUESTAS DEL CHAT
+# ==========================================
+# Preguntas repetidas ("riesgo del equipo X", "anomalías de la planta") sin
+# adjuntos ni estado de la sesión: misma pregunta + mismo equipo + misma
+# versión del Sheet → misma respuesta, sin volver a pagar a Gemini.
+
+_PALABRAS = re.compile(r"\w+")
+
+
+def normalizar_consulta(texto):
+    # Sin acentos, mayúsculas, signos ni espacios repetidos
+    return " ".join(_PALABRAS.findall(normalizar(texto or "")))
+
+
+def clave_respuesta(texto, equipo, version):
+    return (normalizar_consulta(texto), equipo, version)
+
+
+class CacheRespuestas:
+
+    def __init__(self, maximo, ttl):
+        self.maximo = maximo
+        self.ttl = ttl
+        self.datos = OrderedDict()
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.vencidas = 0
+
+    def obtener(self, clave):
+
+        with self.lock:
+            entrada = self.datos.get(clave)
+
+            if entrada is None:
+                self.fallos += 1
+                return None
+
+            guardada, respuesta = entrada
+
+            if time.time() - guardada > self.ttl:
+                del self.datos[clave]
+                self.vencidas += 1
+                self.fallos += 1
+                return None
+
+            self.datos.move_to_end(clave)
+            self.aciertos += 1
+            return respuesta
+
+    def guardar(self, clave, respuesta):
+
+        with self.lock:
+            self.datos[clave] = (time.time(), respuesta)
+            self.datos.move_to_end(clave)
+            while len(self.datos) > self.maximo:
+                self.datos.popitem(last=False)
+
+    def reporte(self):
+
+        with self.lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self.datos),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "vencidas": self.vencidas,
+                "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else 0.0,
+            }
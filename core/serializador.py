@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+# ==========================================
+# CACHE LRU DE FILAS RENDERIZADAS
+# ==========================================
+# Clave: (versión de datos, formato, fila). Al cambiar la versión las
+# entradas viejas dejan de pedirse y salen solas por LRU.
+
+class CacheLRU:
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self.datos = OrderedDict()
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, calcular):
+        with self.lock:
+            if clave in self.datos:
+                self.datos.move_to_end(clave)
+                self.aciertos += 1
+                return self.datos[clave]
+            self.fallos += 1
+
+        valor = calcular()
+
+        with self.lock:
+            self.datos[clave] = valor
+            self.datos.move_to_end(clave)
+            while len(self.datos) > self.maximo:
+                self.datos.popitem(last=False)
+
+        return valor
+
+
+CACHE_FILAS = CacheLRU(maximo=5000)
+
+
+# ==========================================
+# SERIALIZADOR DE FILAS (PEREZOSO)
+# ==========================================
+# No guarda copias de columnas ni piezas "Columna: Valor" preformateadas:
+# cada fila se renderiza al pedirla, leyendo por posición del DataFrame
+# compacto (categorías / strings pyarrow), y queda en el LRU.
+
+# Columnas de control internas del RAG: no aportan al historial
+COLUMNAS_SIN_RESUMEN = ["TEXTO_RAG", "TEXTO_RAG_NORM", "TEXTO_COMPLETO"]
+
+
+def _pieza_resumen(col, valor):
+    # Solo celdas con valor real (no NaN, no nulo, no vacío)
+    if pd.notna(valor) and str(valor).strip() != "" and str(valor).lower() != "nan":
+        return f"{col}: {str(valor).strip()}"
+    return None
+
+
+class SerializadorFilas:
+
+    def __init__(self, df, version=None, cache=CACHE_FILAS):
+
+        # Sin versión (DataFrame fuera del cache) no se memoriza nada
+        self.version = version
+        self.cache = cache
+        self.enlazar(df)
+
+    def enlazar(self, df):
+        self.total_filas = len(df)
+        # Referencias a los arrays de cada columna (no copias): leer una
+        # celda por posición evita armar una Serie por fila con df.iloc
+        self.columnas = {col: df[col].array for col in df.columns}
+        self.columnas_resumen = [col for col in df.columns if col not in COLUMNAS_SIN_RESUMEN]
+
+    # Ni las columnas (van en el Feather) ni el LRU global viajan en el
+    # snapshot: al restaurar se vuelve a enlazar con enlazar(df)
+    def __getstate__(self):
+        estado = dict(self.__dict__)
+        estado.pop("cache", None)
+        estado.pop("columnas", None)
+        return estado
+
+    def __setstate__(self, estado):
+        self.__dict__.update(estado)
+        self.cache = CACHE_FILAS
+        self.columnas = {}
+
+    def _celda(self, pos, col):
+        if col in self.columnas:
+            return self.columnas[col][pos]
+        return ""
+
+    # ---------- formato compacto: "Columna: Valor | ..." ----------
+
+    def _resumen(self, pos):
+        piezas = (_pieza_resumen(col, self.columnas[col][pos]) for col in self.columnas_resumen)
+        return " | ".join(p for p in piezas if p is not None)
+
+    def resumen(self, pos):
+        pos = int(pos)
+        if self.version is None:
+            return self._resumen(pos)
+        return self.cache.obtener((self.version, "resumen", pos), lambda: self._resumen(pos))
+
+    # ---------- formato bloque con emojis ----------
+
+    def _bloque(self, pos):
+        return f"""
+🔧 Equipo: {self._celda(pos, "CODIGO_EXTRAIDO")}
+📌 Descripción: {self._celda(pos, "DESCRIPCION_EXTRAIDA")}
+
+🛠️ Trabajo realizado:
+{self._celda(pos, "TEXTO_RAG")}
+"""
+
+    def bloque(self, pos):
+        pos = int(pos)
+        if self.version is None:
+            return self._bloque(pos)
+        return self.cache.obtener((self.version, "bloque", pos), lambda: self._bloque(pos))
+
+    def texto_rag(self, pos):
+        return self._celda(int(pos), "TEXTO_RAG")
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+# ==========================================
+# ESTADO DE UNA SESIÓN DE CHAT
+# ==========================================
+# Todo lo que el servidor guarda de un session_id vive aquí y se desaloja
+# junto: chat nativo de Gemini, último contexto del Sheet, último equipo
+# consultado y el lock que serializa los mensajes de la sesión.
+
+def _bytes_contenido(contenido):
+
+    # protos.Content de Gemini (partes de texto o binarias) o texto plano
+    partes = getattr(contenido, "parts", None)
+    if partes is None:
+        return len(str(contenido).encode("utf-8"))
+
+    total = 0
+    for parte in partes:
+        texto = getattr(parte, "text", "")
+        datos = getattr(getattr(parte, "inline_data", None), "data", b"")
+        total += len(texto.encode("utf-8")) + len(datos or b"")
+    return total
+
+
+class Sesion:
+
+    def __init__(self, crear_chat):
+        self.crear_chat = crear_chat
+        self.chat = None
+        self.contexto_sheet = None
+        # (equipo, versión de datos, posiciones de sus filas en el DataFrame en cache)
+        self.ultimo_resultado = None
+        self.lock = asyncio.Lock()
+        self.creada = time.time()
+        self.ultimo_uso = self.creada
+        # Tamaño y turnos medidos en el último recorte (el reporte del
+        # almacén los suma sin volver a codificar historiales)
+        self.bytes = 0
+        self.turnos = 0
+        self.almacenada = True
+
+    def obtener_chat(self):
+        if self.chat is None:
+            # Crea una sesión de chat nativa que gestiona automáticamente el historial
+            self.chat = self.crear_chat()
+        return self.chat
+
+    def historial(self):
+        if self.chat is None:
+            return []
+        return self.chat.history
+
+    def agregar_turno(self, mensaje, respuesta):
+        # Turno resuelto sin llamar a Gemini (p. ej. desde el cache de respuestas)
+        chat = self.obtener_chat()
+        chat.history = list(chat.history) + [
+            {"role": "user", "parts": [mensaje]},
+            {"role": "model", "parts": [respuesta]},
+        ]
+
+    def recortar_historial(self, max_turnos, max_bytes):
+
+        historial = list(self.historial())
+
+        # Turnos = pares (usuario, modelo): se corta siempre en número par
+        # para que el historial siga empezando por un mensaje del usuario
+        inicio = max(0, len(historial) - max_turnos * 2)
+        tamanos = [_bytes_contenido(c) for c in historial]
+
+        # Además del tope de turnos, tope de bytes (los prompts llevan el
+        # contexto del Sheet); el último turno se conserva siempre
+        while inicio < len(historial) - 2 and sum(tamanos[inicio:]) > max_bytes:
+            inicio += 2
+
+        if inicio:
+            self.chat.history = historial[inicio:]
+
+        self.bytes = sum(tamanos[inicio:]) + self._bytes_contexto()
+        self.turnos = (len(historial) - inicio) // 2
+
+        return inicio // 2
+
+    def _bytes_contexto(self):
+        if self.contexto_sheet:
+            return len(self.contexto_sheet.encode("utf-8"))
+        return 0
+
+    def bytes_estimados(self):
+        return sum(_bytes_contenido(c) for c in self.historial()) + self._bytes_contexto()
+
+
+# ==========================================
+# ALMACÉN DE SESIONES CON TTL + LRU
+# ==========================================
+
+class AlmacenSesiones:
+
+    def __init__(self, crear_chat, ttl, maximo, max_turnos, max_bytes_sesion):
+        self.crear_chat = crear_chat
+        self.ttl = ttl
+        self.maximo = maximo
+        self.max_turnos = max_turnos
+        self.max_bytes_sesion = max_bytes_sesion
+
+        # Orden LRU: la menos usada al principio
+        self.sesiones = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.desalojadas = 0
+        self.turnos_recortados = 0
+
+        # Totales de las sesiones almacenadas, al día en cada recorte/desalojo
+        self.bytes_total = 0
+        self.turnos_total = 0
+
+    def obtener(self, session_id):
+
+        with self.lock:
+            sesion = self.sesiones.get(session_id)
+
+            if sesion is None:
+                sesion = Sesion(self.crear_chat)
+                self.sesiones[session_id] = sesion
+
+            sesion.ultimo_uso = time.time()
+            self.sesiones.move_to_end(session_id)
+
+            self._purgar()
+
+        return sesion
+
+    def _purgar(self):
+
+        limite = time.time() - self.ttl
+
+        for session_id, sesion in list(self.sesiones.items()):
+            vencida = sesion.ultimo_uso < limite
+            sobra = len(self.sesiones) > self.maximo
+
+            if not (vencida or sobra):
+                # Orden LRU: las siguientes son más recientes
+                break
+
+            # Una sesión con un mensaje en curso no se desaloja
+            if sesion.lock.locked():
+                continue
+
+            del self.sesiones[session_id]
+            self.desalojadas += 1
+            sesion.almacenada = False
+            self.bytes_total -= sesion.bytes
+            self.turnos_total -= sesion.turnos
+
+    def recortar(self, sesion):
+
+        bytes_antes, turnos_antes = sesion.bytes, sesion.turnos
+        recortados = sesion.recortar_historial(self.max_turnos, self.max_bytes_sesion)
+
+        with self.lock:
+            self.turnos_recortados += recortados
+            # Una sesión ya desalojada no cuenta en los totales
+            if sesion.almacenada:
+                self.bytes_total += sesion.bytes - bytes_antes
+                self.turnos_total += sesion.turnos - turnos_antes
+
+        return recortados
+
+    def reporte(self):
+
+        # O(1): totales mantenidos en recortar/_purgar
+        with self.lock:
+            return {
+                "sesiones": len(self.sesiones),
+                "turnos": self.turnos_total,
+                "bytes": self.bytes_total,
+                "desalojadas": self.desalojadas,
+                "turnos_recortados": self.turnos_recortados,
+            }
+
+
+def imprimir_reporte_sesiones(reporte):
+    print(
+        f"🗂️ Sesiones: {reporte['sesiones']} activas, {reporte['turnos']} turnos, "
+        f"{reporte['bytes'] / 1024:.1f} KB | desalojadas: {reporte['desalojadas']}, "
+        f"turnos recortados: {reporte['turnos_recortados']}"
+    )
@@ -0,0 +1,156 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+# ==========================================
+# TABLA DE TRADUCCIÓN PEREZOSA
+# ==========================================
+# Cada carácter se resuelve una sola vez (NFD + filtro) y queda memorizado.
+# NFD por carácter equivale a NFD del texto completo salvo el reordenamiento
+# de marcas combinantes, que de todas formas se eliminan.
+# Se guarda None (borrar) u ordinal cuando se puede: str.translate es más
+# rápido con esos valores que con strings.
+
+_PERMITIDO = re.compile(r'[a-z0-9\s]')
+
+
+def _valor_traduccion(valor):
+    if not valor:
+        return None
+    if len(valor) == 1:
+        return ord(valor)
+    return valor
+
+
+class _TablaNormalizacion(dict):
+
+    def __missing__(self, codigo):
+        valor = _valor_traduccion("".join(
+            d for d in unicodedata.normalize('NFD', chr(codigo))
+            if _PERMITIDO.match(d)
+        ))
+        self[codigo] = valor
+        return valor
+
+
+class _TablaAcentos(dict):
+
+    def __missing__(self, codigo):
+        valor = _valor_traduccion("".join(
+            d for d in unicodedata.normalize('NFD', chr(codigo))
+            if unicodedata.category(d) != 'Mn'
+        ))
+        self[codigo] = valor
+        return valor
+
+
+TABLA_NORMALIZACION = _TablaNormalizacion()
+TABLA_ACENTOS = _TablaAcentos()
+
+
+# ==========================================
+# NORMALIZADOR
+# ==========================================
+
+def normalizar(texto):
+    # minúsculas, sin acentos, solo [a-z0-9] y espacios
+    if not texto:
+        return ""
+    return str(texto).lower().translate(TABLA_NORMALIZACION).strip()
+
+
+def quitar_acentos(texto):
+    return texto.translate(TABLA_ACENTOS)
+
+
+def normalizar_simbolos(texto):
+    # Variante que conserva guiones y símbolos (solo minúsculas y sin acentos)
+    if not texto:
+        return ""
+    return quitar_acentos(str(texto).lower())
+
+
+def normalizar_serie(serie):
+
+    # Se normaliza cada valor distinto una sola vez y se reexpande:
+    # columnas con valores repetidos (códigos, técnicos, tipos) cuestan
+    # lo que cuesta su cardinalidad, no su número de filas
+    codigos, uniques = pd.factorize(serie, use_na_sentinel=False)
+
+    normalizados = np.array([normalizar(v) for v in uniques], dtype=object)
+
+    return pd.Series(normalizados[codigos], index=serie.index)
+
+
+# ==========================================
+# CONCATENACIÓN DE COLUMNAS (POR COLUMNA, NO POR FILA)
+# ==========================================
+# Equivale a df[columnas].fillna("").astype(str).agg(sep.join, axis=1),
+# pero concatenando columnas enteras (suma de arrays de objetos) en vez de
+# un join de Python por fila. Cada columna se convierte a texto una sola vez
+# y se comparte entre todos los textos que la usan (TEXTO_RAG, TEXTO_COMPLETO).
+#
+# Versión normalizada: minúsculas + tabla de traducción son carácter a
+# carácter, así que se normaliza cada valor distinto de cada columna y se
+# concatena; el strip final se hace sobre el texto completo. Única excepción:
+# la sigma mayúscula (su minúscula depende del contexto) → normalización
+# del texto completo.
+
+class ConcatenadorColumnas:
+
+    def __init__(self, df):
+        self.df = df
+        self.textos = {}
+        self.partes_normalizadas = {}
+
+    def texto(self, col):
+        if col not in self.textos:
+            self.textos[col] = self.df[col].fillna("").astype(str).to_numpy(dtype=object)
+        return self.textos[col]
+
+    def parte_normalizada(self, col):
+
+        if col not in self.partes_normalizadas:
+            codigos, uniques = pd.factorize(self.texto(col))
+
+            if any("Σ" in v for v in uniques):
+                self.partes_normalizadas[col] = None
+            else:
+                normalizados = np.array(
+                    [v.lower().translate(TABLA_NORMALIZACION) for v in uniques],
+                    dtype=object
+                )
+                self.partes_normalizadas[col] = normalizados[codigos]
+
+        return self.partes_normalizadas[col]
+
+    def _sumar(self, partes, sep):
+        resultado = partes[0]
+        for parte in partes[1:]:
+            resultado = resultado + sep + parte
+        return resultado
+
+    def concatenar(self, columnas, sep):
+
+        if not columnas:
+            return pd.Series("", index=self.df.index, dtype=object)
+
+        return pd.Series(self._sumar([self.texto(c) for c in columnas], sep), index=self.df.index)
+
+    def concatenar_normalizado(self, columnas, sep):
+
+        # normalizar(concatenar(columnas, sep)) sin normalizar fila por fila
+        partes = [self.parte_normalizada(c) for c in columnas]
+
+        if not columnas or any(p is None for p in partes):
+            return normalizar_serie(self.concatenar(columnas, sep))
+
+        sep_normalizado = sep.lower().translate(TABLA_NORMALIZACION)
+
+        return pd.Series(
+            self._sumar(partes, sep_normalizado),
+            index=self.df.index
+        ).str.strip()
@@ -1,31 +1,28 @@
 import google.generativeai as genai
 from fastapi import FastAPI, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from collections import defaultdict
 from core.insights import obtener_insights, obtener_columna_principal
 import os
-import pandas as pd
-import io
 import unicodedata
 import re
-import pdfplumber
-from docx import Document
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from core.analytics import ejecutar_analisis, generar_analisis_tecnico_avanzado
-from core.rag import buscar_en_sheet, obtener_dataframe, formatear_contexto
+from core.rag import buscar_en_sheet, obtener_snapshot, formatear_contexto, formatear_bloques
 from core.rag import normalizar
 from core.insights import obtener_insights
-from core.rag import cargar_datos
-from PIL import Image
-import io
+from core.rag import cargar_datos, particion_en_snapshot
+from core.indices import buscar_equipo
+from core.adjuntos import extractor_para, abrir_imagen, guardar_en_temporal, borrar_temporal
+from core.contexto import EnsambladorContexto, imprimir_reporte_contexto
+from core.sesiones import AlmacenSesiones, imprimir_reporte_sesiones
+from core.respuestas import CacheRespuestas, clave_respuesta
 
 cargar_datos()
 
-memoria_usuario = {
-    "ultimo_equipo": None,
-    "ultimo_resultado": None
-}
-
-
 def es_consulta_tecnica(texto):
     if not texto:
         return False
@@ -122,35 +119,31 @@ def analizar_entidad(df, texto_usuario):
 # DETECTOR INTELIGENTE DE EQUIPO
 # ==========================================
 
-def detectar_equipo_en_texto(df, texto):
+def detectar_equipo_en_texto(snapshot, texto):
+    df = snapshot["df"]
+
     if df is None or df.empty:
         return None
 
     if df is None or not texto:
         return None
 
-    texto = texto.lower()
-
-    for _, row in df.iterrows():
-        codigo = str(row.get("CODIGO_EXTRAIDO", "")).lower()
-        desc = str(row.get("DESCRIPCION_EXTRAIDA", "")).lower()
-
-        # 🔥 prioridad: codigo
-        if codigo and codigo in texto:
-            return row.get("CODIGO_EXTRAIDO")
-
-        # 🔥 fallback: descripcion → retorna codigo
-        if desc and desc in texto:
-            return row.get("CODIGO_EXTRAIDO")
-
-    return None
-
+    # 🔥 prioridad: codigo / fallback: descripcion → retorna codigo
+    # (índice precompilado en cada recarga de datos)
+    return buscar_equipo(snapshot["indice_equipos"], texto)
 
 # ==========================================
 # CONFIGURACIÓN GEMINI (MEJORADA PARA CHAT)
 # ==========================================
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+# "simple" = primeras coincidencias en orden de la hoja | "bm25" = código y
+# descripción igual que "simple", el texto libre rankeado por relevancia
+MODO_BUSQUEDA_RAG = os.getenv("RAG_MODO_BUSQUEDA", "simple")
+
+# Presupuesto (tokens estimados) para todo el contexto inyectado en el prompt
+PRESUPUESTO_CONTEXTO = int(os.getenv("CONTEXTO_MAX_TOKENS", "6000"))
 print("API KEY CARGADA:", GEMINI_API_KEY[:15] if GEMINI_API_KEY else "NO EXISTE")
 
 import requests
@@ -219,40 +212,240 @@ model = genai.GenerativeModel(
 app = FastAPI()
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
-# Diccionario para almacenar las sesiones de chat activas con historial nativo de Gemini
+# Sesiones activas (chat nativo de Gemini + último contexto del Sheet).
+# Acotadas: vencen por inactividad, se desalojan por LRU y su historial se
+# recorta a los últimos turnos.
 if "sesiones_chat" not in globals():
-    sesiones_chat = {}
+    sesiones_chat = AlmacenSesiones(
+        crear_chat=lambda: model.start_chat(history=[]),
+        ttl=int(os.getenv("SESION_TTL", "3600")),
+        maximo=int(os.getenv("SESION_MAX", "500")),
+        max_turnos=int(os.getenv("SESION_MAX_TURNOS", "20")),
+        max_bytes_sesion=int(os.getenv("SESION_MAX_BYTES", str(512 * 1024)))
+    )
+
+
+# Cache opcional de respuestas para preguntas repetidas sin adjuntos
+USAR_CACHE_RESPUESTAS = os.getenv("CHAT_CACHE_RESPUESTAS", "0") == "1"
 
-# Memoria para conservar contextos previos de Excel por sesión de usuario
-memoria_contexto_sheet = {}
+cache_respuestas = CacheRespuestas(
+    maximo=int(os.getenv("CHAT_CACHE_MAX", "1000")),
+    ttl=int(os.getenv("CHAT_CACHE_TTL", "900"))
+)
 
 
 # ==========================================
-# EXTRACTORES LOCALES (MANTENIDOS SIN CAMBIOS)
+# POOLS DE TRABAJO (FUERA DEL EVENT LOOP)
 # ==========================================
 
-def extraer_de_pdf(bytes_file):
-    with pdfplumber.open(io.BytesIO(bytes_file)) as pdf:
-        return "\n".join([page.extract_text() or "" for page in pdf.pages])
+# Hilos: pandas, índices y búsqueda sobre el DataFrame en cache
+POOL_HILOS = ThreadPoolExecutor(max_workers=int(os.getenv("CHAT_MAX_HILOS", "4")))
+
+# Procesos: parseo de PDF/DOCX/Excel (Python puro, retiene el GIL)
+# (spawn: los workers no heredan hilos ni el DataFrame del proceso principal)
+def crear_pool_procesos():
+    return ProcessPoolExecutor(
+        max_workers=int(os.getenv("CHAT_MAX_PROCESOS", "2")),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+POOL_PROCESOS = crear_pool_procesos()
 
-def extraer_de_docx(bytes_file):
-    doc = Document(io.BytesIO(bytes_file))
-    return "\n".join([p.text for p in doc.paragraphs])
+async def en_pool(pool, funcion, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, partial(funcion, *args))
 
-def extraer_de_excel_adjunto(bytes_file):
-    df = pd.read_excel(io.BytesIO(bytes_file))
-    return df.head(20).to_markdown(index=False)
+async def en_pool_procesos(funcion, *args):
+
+    global POOL_PROCESOS
+
+    pool = POOL_PROCESOS
+
+    try:
+        return await en_pool(pool, funcion, *args)
+    except BrokenProcessPool:
+        # Un worker murió (p. ej. OOM con un PDF enorme): el pool queda roto
+        # para siempre. Se reemplaza (una sola vez aunque fallen varias
+        # peticiones a la vez) y esta petición falla; las siguientes no
+        if POOL_PROCESOS is pool:
+            POOL_PROCESOS = crear_pool_procesos()
+            pool.shutdown(wait=False)
+        raise
 
 
 # ==========================================
-# FUNCIÓN AUXILIAR DE CHAT CON MEMORIA
+# CONSTRUCCIÓN DEL CONTEXTO (SÍNCRONA: CORRE EN POOL_HILOS)
 # ==========================================
 
-def obtener_o_crear_chat(session_id):
-    if session_id not in sesiones_chat:
-        # Crea una sesión de chat nativa que gestiona automáticamente el historial
-        sesiones_chat[session_id] = model.start_chat(history=[])
-    return sesiones_chat[session_id]
+def construir_prompt(texto, sesion):
+
+    equipo_detectado = None
+    ensamblador = EnsambladorContexto(PRESUPUESTO_CONTEXTO)
+
+    # El prompt depende del estado de la sesión (seguimientos): no se cachea
+    usa_estado_sesion = False
+
+    # df, índices, particiones y serializador del mismo snapshot: un refresco
+    # publicado a mitad de la petición no obliga a reconstruirlos aquí
+    snapshot = obtener_snapshot()
+    df = snapshot["df"]
+    if df is None or df.empty:
+        return None, "No se pudo cargar la base de datos.", None
+
+    equipo_detectado = detectar_equipo_en_texto(snapshot, texto)  
+
+    # Clasificadores de consultas
+    usar_excel = es_consulta_tecnica(texto)
+    es_analitica = es_pregunta_analitica(texto)        
+    insights = obtener_insights()
+    col_equipo = obtener_columna_principal(df)
+
+    if col_equipo is None:
+        return None, "No se encontró columna principal de equipos en la base de datos.", None
+
+    # ==========================================
+    # 🔮 EXTRAER PREDICCIÓN DE RIESGO
+    # ==========================================
+    if any(p in texto.lower() for p in ["riesgo", "fallar", "falla", "probabilidad"]):
+        if equipo_detectado and "riesgo_equipos" in insights:
+            data = insights["riesgo_equipos"].get(equipo_detectado)
+            if data:
+                ensamblador.agregar("riesgo", "", [(
+                    f"\n[DATOS DE RIESGO DE LA BD]:\n"
+                    f"- Equipo: {equipo_detectado}\n"
+                    f"- Nivel de riesgo: {data['riesgo']}\n"
+                    f"- Score: {data['score']}\n"
+                    f"- Motivos: {', '.join(data['motivo'])}\n"
+                )], prioridad=0)
+
+    # ==========================================
+    # 🚨 EXTRAER DETECCIÓN DE ANOMALÍAS
+    # ==========================================
+    if any(p in texto.lower() for p in ["anomalia", "anomalía", "raro", "fuera de lo normal"]):
+        anomalias = insights.get("anomalias", {})
+        if equipo_detectado:
+            data = anomalias.get(equipo_detectado)
+            if data:
+                ensamblador.agregar("anomalia", "", [(
+                    f"\n[ANOMALÍA DETECTADA EN HISTORIAL]:\n"
+                    f"- Equipo: {equipo_detectado}\n"
+                    f"- Tipo: {data['tipo']} (Nivel: {data['nivel']})\n"
+                    f"- Valor actual: {data['valor_actual']} (Promedio: {data['promedio']})\n"
+                    f"- Z-score: {data['z_score']}\n"
+                )], prioridad=1)
+        else:
+            if anomalias:
+                resumen_anomalias = ""
+                for eq, data in list(anomalias.items())[:5]:
+                    resumen_anomalias += f"- {eq} | Nivel: {data['nivel']} | Z-score: {data['z_score']}\n"
+                ensamblador.agregar("anomalia", "", [
+                    f"\n[ANOMALÍAS GENERALES EN LA PLANTA (Top 5)]:\n{resumen_anomalias}"
+                ], prioridad=1)
+
+    # ==========================================
+    # 📊 HISTORIAL DINÁMICO POR EQUIPO (AHORRO MÁXIMO DE TOKENS)
+    # ==========================================
+    if equipo_detectado and df is not None:
+        # Filas asociadas al equipo detectado (partición precalculada en la carga)
+        filas_equipo = particion_en_snapshot(snapshot, equipo_detectado)
+
+        if len(filas_equipo):
+            # Solo posiciones sobre el DataFrame en cache (sin copiar filas)
+            sesion.ultimo_resultado = (equipo_detectado, df.attrs.get("version"), filas_equipo)
+
+            # Resumen "Columna: Valor | ..." de cada fila (serializado una vez por versión)
+            serializador = snapshot["serializador"]
+
+            # Del más reciente hacia atrás hasta agotar el presupuesto; se
+            # muestran en orden cronológico. Solo se serializa lo que entra.
+            lineas_historial = (
+                "• " + r
+                for r in (serializador.resumen(pos) for pos in filas_equipo[::-1])
+                if r
+            )
+
+            ensamblador.agregar(
+                "historial",
+                f"\n[REGISTROS DE MANTENIMIENTO REALES PARA EL EQUIPO {equipo_detectado}]:\n",
+                lineas_historial,
+                prioridad=2,
+                invertir=True
+            )
+
+    # ==========================================
+    # 🔥 MODO ANALÍTICO AVANZADO INTEGRADO
+    # ==========================================
+    if es_analitica and sesion.ultimo_resultado is not None:
+        usa_estado_sesion = True
+        ultimo_equipo, version, filas = sesion.ultimo_resultado
+
+        # Si el Sheet se refrescó entre mensajes las posiciones ya no valen
+        if version != df.attrs.get("version"):
+            filas = particion_en_snapshot(snapshot, ultimo_equipo)
+
+        serializador = snapshot["serializador"]
+
+        ensamblador.agregar(
+            "analitico",
+            f"\n[HISTORIAL ADICIONAL DE ANÁLISIS DE {ultimo_equipo}]:\n",
+            (serializador.texto_rag(pos) for pos in filas[::-1]),
+            prioridad=3,
+            invertir=True,
+            separador=" "
+        )
+
+    contexto_soporte_interno, reporte_contexto = ensamblador.ensamblar()
+
+    # ==========================================
+    # 🌐 BÚSQUEDA EN SHEETS (RAG TRADICIONAL)
+    # ==========================================
+    contexto_sheet = ""
+    # Si no se generó un bloque de equipo específico, hacemos una búsqueda RAG genérica
+    if usar_excel and not contexto_soporte_interno:
+        resultado = buscar_en_sheet(texto or "", modo=MODO_BUSQUEDA_RAG)
+
+        # Hits RAG ya vienen rankeados: entran en orden hasta el presupuesto
+        ensamblador_rag = EnsambladorContexto(PRESUPUESTO_CONTEXTO)
+        ensamblador_rag.agregar("rag", "", formatear_bloques(resultado), prioridad=0, separador="\n\n")
+        contexto_sheet, reporte_rag = ensamblador_rag.ensamblar()
+        reporte_contexto.update(reporte_rag)
+
+        # Sin resultados: aviso de "No se encontró información". Si hubo hits
+        # pero ninguno entra en el presupuesto, no se inyecta nada
+        if resultado is None or resultado.empty:
+            contexto_sheet = formatear_contexto(resultado)
+
+        if contexto_sheet:
+            sesion.contexto_sheet = contexto_sheet
+    elif sesion.contexto_sheet and not contexto_soporte_interno:
+        contexto_sheet = sesion.contexto_sheet
+        usa_estado_sesion = True
+
+    imprimir_reporte_contexto(reporte_contexto, PRESUPUESTO_CONTEXTO)
+
+    # ==========================================
+    # 💬 PROMPT PARA EL CHAT NATIVO CON GEMINI
+    # ==========================================
+
+    # Inyectamos de forma limpia el contexto técnico para que Gemini responda conversacionalmente
+    prompt_inyectado = ""
+    if contexto_soporte_interno:
+        prompt_inyectado += f"\n[DATOS TÉCNICOS HISTÓRICOS Y SENSORIZADOS]:\n{contexto_soporte_interno}\n"
+    elif contexto_sheet:
+        prompt_inyectado += f"\n[REGISTROS EXCEL DE SOPORTE]:\n{contexto_sheet}\n"
+
+    prompt_final = (
+        f"{prompt_inyectado}"
+        f"El usuario te hace la siguiente consulta en el chat. "
+        f"Responde de forma redactada, natural, amigable y muy fluida como un Ingeniero Senior de Mantenimiento:\n"
+        f"Mensaje del Colaborador: {texto}"
+    )
+
+    clave_cache = None
+    if not usa_estado_sesion:
+        clave_cache = clave_respuesta(texto, equipo_detectado, df.attrs.get("version"))
+
+    return prompt_final, None, clave_cache
 
 
 # ==========================================
@@ -274,207 +467,99 @@ async def chat(
           print("NO SE RECIBIÓ ARCHIVO")
 
 
-    df = None
     texto_extraido = ""
-    equipo_detectado = None
-    contexto_soporte_interno = ""
     imagen = None
 
     try:            
         # -------- PROCESAMIENTO DE ARCHIVO --------
         if archivo:
             mimetype = archivo.content_type
-            bytes_file = await archivo.read()
+
+            # Volcado a disco por bloques: al worker solo viaja la ruta
+            ruta, tamano = await en_pool(POOL_HILOS, guardar_en_temporal, archivo.file)
 
             print(f"ARCHIVO: {archivo.filename}")
             print(f"MIME: {mimetype}")
-            print(f"TAMAÑO: {len(bytes_file)/1024/1024:.2f} MB")
+            print(f"TAMAÑO: {tamano/1024/1024:.2f} MB")
+
+            try:
+                extractor = extractor_para(mimetype)
 
-            if "pdf" in mimetype:
-                texto_extraido = extraer_de_pdf(bytes_file)
-            elif "word" in mimetype or "officedocument.wordprocessingml" in mimetype:
-                texto_extraido = extraer_de_docx(bytes_file)
-            elif "excel" in mimetype or "officedocument.spreadsheetml" in mimetype:
-                texto_extraido = extraer_de_excel_adjunto(bytes_file)
+                if extractor:
+                    texto_extraido = await en_pool_procesos(extractor, ruta)
 
-            elif "image" in mimetype:
+                elif "image" in mimetype:
 
-                 imagen = Image.open(io.BytesIO(bytes_file))
-                 
-                 imagen = imagen.convert("RGB")
+                     imagen = await en_pool(POOL_HILOS, abrir_imagen, ruta)
 
-                 texto_extraido = "[Imagen enviada por el usuario]"
-                 print("RESOLUCION:", imagen.size)
+                     texto_extraido = "[Imagen enviada por el usuario]"
+                     print("RESOLUCION:", imagen.size)
+            finally:
+                borrar_temporal(ruta)
                 
         # Si se extrajo texto del archivo, lo agregamos a la consulta
         if texto_extraido:
             texto = (texto or "") + "\n\nContenido del archivo:\n" + texto_extraido
 
-        df = obtener_dataframe()
-        if df is None or df.empty:
-            return {"respuesta": "No se pudo cargar la base de datos.", "tokens_usados": 0}
-         
-        equipo_detectado = detectar_equipo_en_texto(df, texto)  
-        
-        # Clasificadores de consultas
-        usar_excel = es_consulta_tecnica(texto)
-        es_analitica = es_pregunta_analitica(texto)        
-        insights = obtener_insights()
-        col_equipo = obtener_columna_principal(df)
-
-        if col_equipo is None:
-            return {
-                "respuesta": "No se encontró columna principal de equipos en la base de datos.",
-                "tokens_usados": 0
-            }
-        
-        # ==========================================
-        # 🔮 EXTRAER PREDICCIÓN DE RIESGO
-        # ==========================================
-        if any(p in texto.lower() for p in ["riesgo", "fallar", "falla", "probabilidad"]):
-            if equipo_detectado and "riesgo_equipos" in insights:
-                data = insights["riesgo_equipos"].get(equipo_detectado)
-                if data:
-                    contexto_soporte_interno += (
-                        f"\n[DATOS DE RIESGO DE LA BD]:\n"
-                        f"- Equipo: {equipo_detectado}\n"
-                        f"- Nivel de riesgo: {data['riesgo']}\n"
-                        f"- Score: {data['score']}\n"
-                        f"- Motivos: {', '.join(data['motivo'])}\n"
-                    )
-
-        # ==========================================
-        # 🚨 EXTRAER DETECCIÓN DE ANOMALÍAS
-        # ==========================================
-        if any(p in texto.lower() for p in ["anomalia", "anomalía", "raro", "fuera de lo normal"]):
-            anomalias = insights.get("anomalias", {})
-            if equipo_detectado:
-                data = anomalias.get(equipo_detectado)
-                if data:
-                    contexto_soporte_interno += (
-                        f"\n[ANOMALÍA DETECTADA EN HISTORIAL]:\n"
-                        f"- Equipo: {equipo_detectado}\n"
-                        f"- Tipo: {data['tipo']} (Nivel: {data['nivel']})\n"
-                        f"- Valor actual: {data['valor_actual']} (Promedio: {data['promedio']})\n"
-                        f"- Z-score: {data['z_score']}\n"
-                    )
-            else:
-                if anomalias:
-                    resumen_anomalias = ""
-                    for eq, data in list(anomalias.items())[:5]:
-                        resumen_anomalias += f"- {eq} | Nivel: {data['nivel']} | Z-score: {data['z_score']}\n"
-                    contexto_soporte_interno += (
-                        f"\n[ANOMALÍAS GENERALES EN LA PLANTA (Top 5)]:\n{resumen_anomalias}"
-                    )
-
-        # ==========================================
-        # 📊 HISTORIAL DINÁMICO POR EQUIPO (AHORRO MÁXIMO DE TOKENS)
-        # ==========================================
-        if equipo_detectado and df is not None:
-            # Filtrar filas asociadas al equipo detectado
-            df_equipo = df[
-                (df[col_equipo].astype(str) == str(equipo_detectado)) |
-                (df["DESCRIPCION_EXTRAIDA"].astype(str).str.contains(str(equipo_detectado), case=False, na=False)) |
-                (df["DESCRIPCIÓN DEL TRABAJO"].astype(str).str.contains(str(equipo_detectado), case=False, na=False))
-            ]  
-
-            if not df_equipo.empty:
-                memoria_usuario["ultimo_equipo"] = equipo_detectado
-                memoria_usuario["ultimo_resultado"] = df_equipo
-
-                lineas_historial = []
-                
-                # Limitamos a los últimos 15 registros para controlar la ventana de contexto
-                # Analizaremos dinámicamente cada celda de cada fila
-                for _, fila in df_equipo.tail(15).iterrows():
-                    datos_activos = []
-                    
-                    for col in df_equipo.columns:
-                        valor = fila[col]
-                        
-                        # Ignoramos columnas de control internas de tu RAG o vacías para ahorrar tokens
-                        if col in ["TEXTO_RAG", "TEXTO_RAG_NORM", "TEXTO_COMPLETO"]:
-                            continue
-                        
-                        # Filtro inteligente: Verificamos si la celda tiene un valor real (no NaN, no nulo, no vacío)
-                        if pd.notna(valor) and str(valor).strip() != "" and str(valor).lower() != "nan":
-                            # Añade el par "Columna: Valor" (Ej: "Combustible: 45Gln" o "Técnico: Juan")
-                            datos_activos.append(f"{col}: {str(valor).strip()}")
-                    
-                    # Unimos todas las columnas con datos de esta fila usando un separador compacto "|"
-                    if datos_activos:
-                        lineas_historial.append("• " + " | ".join(datos_activos))
-
-                # Unimos todos los registros compactados en un solo bloque de texto
-                historial_sintetizado = "\n".join(lineas_historial)
-
-                contexto_soporte_interno += (
-                    f"\n[REGISTROS DE MANTENIMIENTO REALES PARA EL EQUIPO {equipo_detectado}]:\n"
-                    f"{historial_sintetizado}\n"
-                )
-
-        # ==========================================
-        # 🔥 MODO ANALÍTICO AVANZADO INTEGRADO
-        # ==========================================
-        if es_analitica and memoria_usuario["ultimo_resultado"] is not None:
-            df_eq = memoria_usuario["ultimo_resultado"]
-            resumen_rag = df_eq["TEXTO_RAG"].str.cat(sep=" ")
-            
-            contexto_soporte_interno += (
-                f"\n[HISTORIAL ADICIONAL DE ANÁLISIS DE {memoria_usuario['ultimo_equipo']}]:\n"
-                f"{resumen_rag}\n"
-            )
+        sesion = sesiones_chat.obtener(session_id)
 
-        # ==========================================
-        # 🌐 BÚSQUEDA EN SHEETS (RAG TRADICIONAL)
-        # ==========================================
-        contexto_sheet = ""
-        # Si no se generó un bloque de equipo específico, hacemos una búsqueda RAG genérica
-        if usar_excel and not contexto_soporte_interno:
-            resultado = buscar_en_sheet(texto or "")
-            contexto_sheet = formatear_contexto(resultado)
-            
-            if contexto_sheet:
-                memoria_contexto_sheet[session_id] = contexto_sheet
-        elif session_id in memoria_contexto_sheet and not contexto_soporte_interno:
-            contexto_sheet = memoria_contexto_sheet[session_id]
-
-        # ==========================================
-        # 💬 PROCESO DE CHAT NATIVO CON GEMINI
-        # ==========================================
-        chat_sesion = obtener_o_crear_chat(session_id)
-
-        # Inyectamos de forma limpia el contexto técnico para que Gemini responda conversacionalmente
-        prompt_inyectado = ""
-        if contexto_soporte_interno:
-            prompt_inyectado += f"\n[DATOS TÉCNICOS HISTÓRICOS Y SENSORIZADOS]:\n{contexto_soporte_interno}\n"
-        elif contexto_sheet:
-            prompt_inyectado += f"\n[REGISTROS EXCEL DE SOPORTE]:\n{contexto_sheet}\n"
-
-        prompt_final = (
-            f"{prompt_inyectado}"
-            f"El usuario te hace la siguiente consulta en el chat. "
-            f"Responde de forma redactada, natural, amigable y muy fluida como un Ingeniero Senior de Mantenimiento:\n"
-            f"Mensaje del Colaborador: {texto}"
-        )
+        # Mensajes de una misma sesión en orden: el estado conversacional
+        # (último equipo, contexto del Sheet) y el ChatSession de Gemini no
+        # admiten dos mensajes a la vez. Sesiones distintas corren en paralelo.
+        async with sesion.lock:
 
-        # Enviamos el mensaje al chat con memoria de Gemini
-        if imagen:
+            # Pandas, índices y búsqueda RAG fuera del event loop
+            prompt_final, aviso, clave_cache = await en_pool(POOL_HILOS, construir_prompt, texto, sesion)
 
-            response = chat_sesion.send_message([
-             prompt_final,
-             imagen
-            ])
+            if aviso:
+                return {"respuesta": aviso, "tokens_usados": 0}
 
-        else:
+            # Adjuntos e imágenes nunca pasan por el cache
+            if not USAR_CACHE_RESPUESTAS or archivo:
+                clave_cache = None
+
+            if clave_cache is not None:
+                respuesta_cache = cache_respuestas.obtener(clave_cache)
+
+                if respuesta_cache is not None:
+                    # El turno queda en el historial como si Gemini hubiera respondido
+                    sesion.agregar_turno(prompt_final, respuesta_cache)
+                    sesiones_chat.recortar(sesion)
+
+                    print(f"♻️ Respuesta desde cache: {cache_respuestas.reporte()}")
+                    return {"respuesta": respuesta_cache, "tokens_usados": 0}
+
+            # ==========================================
+            # 💬 PROCESO DE CHAT NATIVO CON GEMINI
+            # ==========================================
+            chat_sesion = sesion.obtener_chat()
+
+            # Enviamos el mensaje al chat con memoria de Gemini (cliente async)
+            if imagen:
+
+                response = await chat_sesion.send_message_async([
+                 prompt_final,
+                 imagen
+                ])
+
+            else:
+
+                 response = await chat_sesion.send_message_async(prompt_final)
+
+            # Solo los últimos turnos siguen viajando a Gemini y ocupando memoria
+            sesiones_chat.recortar(sesion)
+
+            if clave_cache is not None:
+                cache_respuestas.guardar(clave_cache, response.text)
 
-             response = chat_sesion.send_message(prompt_final)
-        
         usage = response.usage_metadata
         total_tokens = usage.total_token_count if usage else 0
 
         print(f"\n--- REPORTE DE CONSUMO CHAT (Sesión: {session_id}) ---")
         print(f"Tokens Totales Usados en esta interacción: {total_tokens}")
+        imprimir_reporte_sesiones(sesiones_chat.reporte())
+        if USAR_CACHE_RESPUESTAS:
+            print(f"♻️ Cache de respuestas: {cache_respuestas.reporte()}")
         print("------------------------------------------\n")
 
         return {
@@ -0,0 +1,98 @@
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.texto import ConcatenadorColumnas, normalizar_serie
+
+
+# ==========================================
+# BENCHMARK: NORMALIZACIÓN POR COLUMNA
+# ==========================================
+# Compara el normalizar fila por fila (NFD + categoría + regex por llamada,
+# como estaba antes en rag/insights) contra normalizar_serie y la
+# concatenación normalizada de ConcatenadorColumnas, sobre un Sheet
+# sintético. Verifica que la salida sea idéntica e imprime los tiempos.
+#
+#   python scripts/bench_normalizar.py [filas] [semilla]
+
+FILAS = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+SEMILLA = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+REPETICIONES = 3
+
+PALABRAS = [
+    "Revisión", "eléctrica", "cambió", "rodamientos", "lubricación", "fajas",
+    "reparación", "fuga", "válvula", "compresor", "ácido", "tensión", "señal",
+    "bomba", "N°", "inspección", "calibración", "sensor", "Ñandú", "niño",
+    "20%", "¿ok?", "(urgente)", "motor", "eje", "piñón",
+]
+
+
+def normalizar_referencia(texto):
+    if not texto:
+        return ""
+    texto = str(texto).lower()
+    texto = "".join(
+        c for c in unicodedata.normalize('NFD', texto)
+        if unicodedata.category(c) != 'Mn'
+    )
+    texto = re.sub(r'[^a-z0-9\s]', '', texto)
+    return texto.strip()
+
+
+def sheet_sintetico(filas, semilla):
+
+    r = random.Random(semilla)
+    codigos = [f"HO-{k:03d}-ÉVNH{k % 7}" for k in range(300)]
+    tecnicos = ["Juan Pérez", "Ana Ruíz", "Luis Muñoz", "María Ñúñez", ""]
+
+    return pd.DataFrame({
+        "CODIGO": [r.choice(codigos) for _ in range(filas)],
+        "TÉCNICO": [r.choice(tecnicos) for _ in range(filas)],
+        "DESCRIPCIÓN DEL TRABAJO": [
+            " ".join(r.choice(PALABRAS) for _ in range(r.randint(6, 20))) + f" OT {k}"
+            for k in range(filas)
+        ],
+    })
+
+
+def medir(funcion):
+    mejor = None
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return resultado, mejor
+
+
+def main():
+
+    df = sheet_sintetico(FILAS, SEMILLA)
+    columnas = list(df.columns)
+
+    print(f"📊 Sheet sintético: {FILAS} filas (semilla {SEMILLA}), mejor de {REPETICIONES}")
+
+    for col in columnas:
+        esperado, t_ref = medir(lambda: df[col].apply(normalizar_referencia))
+        obtenido, t_nuevo = medir(lambda: normalizar_serie(df[col]))
+        assert esperado.tolist() == obtenido.tolist(), col
+        print(f"   - {col}: {t_ref:.3f}s → {t_nuevo:.3f}s ({t_ref / t_nuevo:.1f}x)")
+
+    concatenado = df[columnas].fillna("").astype(str).agg(" | ".join, axis=1)
+    esperado, t_ref = medir(lambda: concatenado.apply(normalizar_referencia))
+    obtenido, t_nuevo = medir(lambda: ConcatenadorColumnas(df).concatenar_normalizado(columnas, " | "))
+    assert esperado.tolist() == obtenido.tolist(), "concatenado"
+    print(f"   - concatenado normalizado: {t_ref:.3f}s → {t_nuevo:.3f}s ({t_ref / t_nuevo:.1f}x)")
+
+    print("✅ Salida idéntica al normalizar fila por fila")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.insights import calcular_riesgo_equipos, obtener_columna_principal
+
+
+# ==========================================
+# BENCHMARK: RIESGO POR EQUIPO
+# ==========================================
+# Compara el cálculo anterior (un filtro + copia del DataFrame por equipo)
+# contra calcular_riesgo_equipos agrupado, sobre un Sheet sintético con
+# distribución de equipos de cola larga. Verifica que el resultado sea
+# idéntico (orden, niveles, motivos, scores y totales), imprime los tiempos
+# y la escala del cálculo agrupado al duplicar las filas.
+#
+#   python scripts/bench_riesgo.py [filas] [equipos] [semilla]
+
+FILAS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+EQUIPOS = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+SEMILLA = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+
+def riesgo_referencia(df):
+
+    if df is None or df.empty:
+        return {}
+
+    col_principal = obtener_columna_principal(df)
+
+    if col_principal is None:
+        return {}
+
+    df = df.copy()
+
+    if "FECHA (DÍA 01)" in df.columns:
+        df["FECHA (DÍA 01)"] = pd.to_datetime(df["FECHA (DÍA 01)"], errors="coerce")
+
+    riesgo_equipos = {}
+
+    for eq in df[col_principal].dropna().unique():
+
+        df_eq = df[df[col_principal] == eq].copy()
+
+        total = len(df_eq)
+
+        frecuencia_score = min(total * 2, 40)
+
+        correctivo_score = 0
+
+        if "TIPO DE MANTENIMIENTO" in df_eq.columns:
+            tipos = df_eq["TIPO DE MANTENIMIENTO"].astype(str).str.upper().value_counts(normalize=True)
+            correctivo_score = tipos.get("CORRECTIVO", 0) * 40
+
+        tendencia_score = 0
+
+        if "FECHA (DÍA 01)" in df_eq.columns:
+
+            df_eq["mes"] = df_eq["FECHA (DÍA 01)"].dt.to_period("M")
+
+            if not df_eq["mes"].isna().all():
+
+                max_mes = df_eq["mes"].max()
+
+                ultimos = df_eq[df_eq["mes"] >= (max_mes - 2)]
+                anteriores = df_eq[df_eq["mes"] < (max_mes - 2)]
+
+                if len(anteriores) > 0:
+                    ratio = len(ultimos) / len(anteriores)
+
+                    if ratio > 2:
+                        tendencia_score = 20
+                    elif ratio > 1.3:
+                        tendencia_score = 10
+
+        variedad_score = 0
+
+        if "DESCRIPCIÓN DEL TRABAJO" in df_eq.columns:
+
+            col_texto = "TEXTO_COMPLETO" if "TEXTO_COMPLETO" in df_eq.columns else "DESCRIPCIÓN DEL TRABAJO"
+
+            tipos_trabajo = df_eq[col_texto].value_counts()
+            variedad_real = len(tipos_trabajo[tipos_trabajo > 1])
+
+            if variedad_real > 10:
+                variedad_score = 10
+            elif variedad_real > 5:
+                variedad_score = 5
+
+        score = frecuencia_score + correctivo_score + tendencia_score + variedad_score
+
+        if score >= 75:
+            nivel = "ALTO"
+        elif score >= 45:
+            nivel = "MEDIO"
+        else:
+            nivel = "BAJO"
+
+        motivos = []
+
+        if frecuencia_score > 25:
+            motivos.append("Alta frecuencia de intervenciones")
+        if correctivo_score > 20:
+            motivos.append("Alto porcentaje de mantenimiento correctivo")
+        if tendencia_score >= 10:
+            motivos.append("Incremento reciente de eventos")
+        if variedad_score > 0:
+            motivos.append("Alta diversidad de fallas detectadas")
+
+        riesgo_equipos[eq] = {
+            "riesgo": nivel,
+            "score": round(score, 2),
+            "motivo": motivos,
+            "total_eventos": total
+        }
+
+    return riesgo_equipos
+
+
+def sheet_sintetico(filas, equipos, semilla):
+
+    r = np.random.default_rng(semilla)
+
+    # Pocos equipos con muchas intervenciones, muchos con pocas
+    codigos = np.array([f"EQ-{k:05d}" for k in range(equipos)])
+    idx = np.minimum((r.pareto(1.2, filas) * equipos / 20).astype(int), equipos - 1)
+
+    fechas = pd.Timestamp("2022-01-01") + pd.to_timedelta(r.integers(0, 900, filas), unit="D")
+    fechas = pd.Series(fechas.strftime("%Y-%m-%d")).where(r.random(filas) > 0.05, "sin fecha")
+
+    return pd.DataFrame({
+        "CODIGO_EXTRAIDO": pd.Series(codigos[idx]).where(r.random(filas) > 0.02, np.nan),
+        "DESCRIPCIÓN DEL TRABAJO": r.choice([f"trabajo {k}" for k in range(40)], filas),
+        "FECHA (DÍA 01)": fechas,
+        "TIPO DE MANTENIMIENTO": r.choice(["Correctivo", "PREVENTIVO", "correctivo", "", "predictivo"], filas),
+    })
+
+
+def medir(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return resultado, time.perf_counter() - inicio
+
+
+def main():
+
+    df = sheet_sintetico(FILAS, EQUIPOS, SEMILLA)
+
+    print(f"📊 Sheet sintético: {FILAS} filas, {df['CODIGO_EXTRAIDO'].nunique()} equipos (semilla {SEMILLA})")
+
+    esperado, t_ref = medir(riesgo_referencia, df)
+    obtenido, t_nuevo = medir(calcular_riesgo_equipos, df)
+
+    assert list(esperado) == list(obtenido), "orden de equipos"
+    assert esperado == obtenido, "resultado"
+
+    print(f"   - por equipo: {t_ref:.2f}s → agrupado: {t_nuevo:.2f}s ({t_ref / t_nuevo:.0f}x)")
+    print("✅ Resultado idéntico al cálculo por equipo")
+
+    print("📈 Escala del cálculo agrupado:")
+    for factor in (1, 2, 4):
+        filas = FILAS * factor // 2
+        _, duracion = medir(calcular_riesgo_equipos, sheet_sintetico(filas, EQUIPOS, SEMILLA))
+        print(f"   - {filas} filas: {duracion:.2f}s")
+
+
+if __name__ == "__main__":
+    main()